@@ -1,11 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List, Optional
+from typing import List, Optional, Dict, Any
 from pydantic import BaseModel
+import json
 import secrets
 import string
 
-from app.core.database import get_db
+from app.core.database import get_db, async_session_maker
 from app.core.security import get_current_user
 from app.models import AIContent, User, Test, Question, TestType
 from app.schemas import (
@@ -17,6 +19,8 @@ from app.schemas import (
     QuestionResponse
 )
 from app.services.ai_service import ai_service
+from app.services.ai_rate_limiter import AIRateLimitError
+from app.services.course_pipeline import course_pipeline
 
 router = APIRouter()
 
@@ -26,6 +30,7 @@ class CourseGenerateRequest(BaseModel):
     duration_days: int
     difficulty: str = "medium"
     learning_style: str = "comprehensive"
+    force_fresh: bool = False
 
 class DayContentRequest(BaseModel):
     topic: str
@@ -40,9 +45,26 @@ class AssessmentRequest(BaseModel):
     num_questions: int = 5
     difficulty: str = "medium"
 
+class CoursePipelineRequest(BaseModel):
+    topic: str
+    course: Dict[str, Any]
+    difficulty: str = "medium"
+    num_questions: int = 5
+    include_assessments: bool = True
+
 def generate_test_code() -> str:
     return ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(6))
 
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def sse_response(events) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/generate-content", response_model=AIContentResponse)
 async def generate_content(
     request: AIContentRequest,
@@ -53,7 +75,9 @@ async def generate_content(
         content = await ai_service.generate_learning_content(
             topic=request.topic,
             content_type=request.content_type,
-            difficulty=request.difficulty
+            difficulty=request.difficulty,
+            use_cache=True,
+            force_fresh=request.force_fresh
         )
         
         ai_content = AIContent(
@@ -69,6 +93,8 @@ async def generate_content(
         await db.refresh(ai_content)
         
         return ai_content
+    except AIRateLimitError:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -85,13 +111,17 @@ async def generate_quiz(
         questions = await ai_service.generate_quiz_questions(
             topic=request.topic,
             num_questions=request.num_questions,
-            difficulty=request.difficulty
+            difficulty=request.difficulty,
+            use_cache=True,
+            force_fresh=request.force_fresh
         )
         
         return AIQuizResponse(
             topic=request.topic,
             questions=questions
         )
+    except AIRateLimitError:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -160,6 +190,8 @@ async def create_ai_test(
         test = result.scalar_one()
         
         return test
+    except AIRateLimitError:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -179,7 +211,9 @@ async def generate_course(
             topic=request.topic,
             duration_days=request.duration_days,
             difficulty=request.difficulty,
-            learning_style=request.learning_style
+            learning_style=request.learning_style,
+            use_cache=True,
+            force_fresh=request.force_fresh
         )
         
         # Store course in AI Content
@@ -203,12 +237,66 @@ async def generate_course(
             "course": course_data,
             "content_id": ai_content.id
         }
+    except AIRateLimitError:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to generate course: {str(e)}"
         )
 
+@router.post("/generate-course/stream")
+async def generate_course_stream(
+    request: CourseGenerateRequest,
+    user: User = Depends(get_current_user)
+):
+    """
+    Stream the course outline as Server-Sent Events: 'chunk' events carry
+    text as it is generated, then 'done' carries the parsed course once it
+    is saved, or 'error' the failure
+    """
+    user_id = user.id
+    
+    async def events():
+        parts = []
+        try:
+            async for text in ai_service.stream_course(
+                topic=request.topic,
+                duration_days=request.duration_days,
+                difficulty=request.difficulty,
+                learning_style=request.learning_style
+            ):
+                parts.append(text)
+                yield sse_event("chunk", {"text": text})
+            
+            course_data = ai_service.parse_course("".join(parts))
+            
+            # The request's session is closed once streaming starts
+            async with async_session_maker() as db:
+                ai_content = AIContent(
+                    user_id=user_id,
+                    topic=request.topic,
+                    content_type="course",
+                    content=str(course_data),
+                    content_metadata={
+                        "duration_days": request.duration_days,
+                        "difficulty": request.difficulty,
+                        "learning_style": request.learning_style
+                    }
+                )
+                db.add(ai_content)
+                await db.commit()
+            
+            yield sse_event("done", {
+                "success": True,
+                "course": course_data,
+                "content_id": ai_content.id
+            })
+        except Exception as e:
+            yield sse_event("error", {"detail": f"Failed to generate course: {str(e)}"})
+    
+    return sse_response(events())
+
 @router.post("/generate-day-content")
 async def generate_day_content(
     request: DayContentRequest,
@@ -247,12 +335,60 @@ async def generate_day_content(
             "content": content,
             "content_id": ai_content.id
         }
+    except AIRateLimitError:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to generate day content: {str(e)}"
         )
 
+@router.post("/generate-day-content/stream")
+async def generate_day_content_stream(
+    request: DayContentRequest,
+    user: User = Depends(get_current_user)
+):
+    """Stream a day's lesson as Server-Sent Events and save it when complete"""
+    user_id = user.id
+    
+    async def events():
+        parts = []
+        try:
+            async for text in ai_service.stream_day_content(
+                topic=request.topic,
+                day_number=request.day_number,
+                lesson_title=request.lesson_title,
+                objectives=request.objectives
+            ):
+                parts.append(text)
+                yield sse_event("chunk", {"text": text})
+            
+            async with async_session_maker() as db:
+                ai_content = AIContent(
+                    user_id=user_id,
+                    topic=f"{request.topic} - Day {request.day_number}",
+                    content_type="lesson",
+                    content="".join(parts),
+                    content_metadata={
+                        "day_number": request.day_number,
+                        "lesson_title": request.lesson_title,
+                        "objectives": request.objectives
+                    }
+                )
+                db.add(ai_content)
+                await db.commit()
+            
+            yield sse_event("done", {
+                "success": True,
+                "day_number": request.day_number,
+                "lesson_title": request.lesson_title,
+                "content_id": ai_content.id
+            })
+        except Exception as e:
+            yield sse_event("error", {"detail": f"Failed to generate day content: {str(e)}"})
+    
+    return sse_response(events())
+
 @router.post("/generate-assessment")
 async def generate_assessment(
     request: AssessmentRequest,
@@ -273,14 +409,52 @@ async def generate_assessment(
             "success": True,
             "day_number": request.day_number,
             "questions": questions,
-            "total_marks": sum(q["marks"] for q in questions)
+            "total_marks": sum(q.get("marks", 0) for q in questions)
         }
+    except AIRateLimitError:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to generate assessment: {str(e)}"
         )
 
+@router.post("/generate-course-pipeline")
+async def generate_course_pipeline(
+    request: CoursePipelineRequest,
+    user: User = Depends(get_current_user)
+):
+    """
+    Generate every lesson and assessment of a course outline in the
+    background. Poll /queue/task/{task_id} for progress_done out of
+    progress_total and the AIContent ids of finished pieces.
+    """
+    if not request.course.get("daily_lessons"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Course outline has no daily lessons"
+        )
+    
+    try:
+        submitted = await course_pipeline.submit(
+            user_id=user.id,
+            topic=request.topic,
+            course=request.course,
+            difficulty=request.difficulty,
+            num_questions=request.num_questions,
+            include_assessments=request.include_assessments
+        )
+        
+        return {
+            "success": True,
+            **submitted
+        }
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to start course generation: {str(e)}"
+        )
+
 @router.post("/create-course-test")
 async def create_course_test(
     request: AssessmentRequest,
@@ -347,6 +521,8 @@ async def create_course_test(
             "test_id": test.id,
             "test_code": test.test_code
         }
+    except AIRateLimitError:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
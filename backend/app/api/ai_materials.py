@@ -8,6 +8,7 @@ from app.core.database import get_db
 from app.core.security import get_current_user
 from app.models import User, AIContent, Question, QuestionType
 from app.services.ai_service import ai_service
+from app.services.ai_rate_limiter import AIRateLimitError
 from app.services.ocr_service import ocr_service
 
 router = APIRouter()
@@ -18,6 +19,8 @@ class GenerateQuestionsRequest(BaseModel):
     difficulty: str = "medium"
     question_types: List[str] = ["multiple_choice", "true_false"]
     test_id: Optional[int] = None
+    # Cover the whole material instead of only its beginning
+    chunked: bool = False
 
 class StudyHelpRequest(BaseModel):
     question: str
@@ -147,7 +150,8 @@ async def generate_questions(
             material.content,
             num_questions=request.num_questions,
             difficulty=request.difficulty,
-            question_types=request.question_types
+            question_types=request.question_types,
+            chunked=request.chunked
         )
         
         print(f"✅ Generated {len(questions)} questions")
@@ -184,11 +188,14 @@ async def generate_questions(
         return {
             "questions": questions,
             "count": len(questions),
+            # Chunked generation can come up short after dropping duplicates
+            "requested": request.num_questions,
             "question_ids": generated_ids,
+            "chunked": request.chunked,
             "status": "success"
         }
         
-    except HTTPException:
+    except (HTTPException, AIRateLimitError):
         raise
     except Exception as e:
         print(f"❌ Question generation error: {str(e)}")
@@ -241,6 +248,8 @@ async def study_help(
             "status": "success"
         }
         
+    except AIRateLimitError:
+        raise
     except Exception as e:
         import traceback
         print(f"❌ Study help error: {str(e)}")
@@ -290,7 +299,7 @@ async def summarize_material(
             "status": "success"
         }
         
-    except HTTPException:
+    except (HTTPException, AIRateLimitError):
         raise
     except Exception as e:
         import traceback
@@ -1,24 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from typing import List
+from typing import List, Optional
 from pydantic import BaseModel
 
+from app.core.config import settings
 from app.core.database import get_db
-from app.core.security import get_current_user
+from app.core.security import get_current_user, get_current_user_id
 from app.models import ProctoringLog, TestAttempt, User
 from app.schemas import FrameAnalysisRequest, ProctoringLogResponse
 from app.services.proctoring_service import proctoring_service
+from app.services.violation_aggregator import violation_aggregator
+from app.services.proctoring_log_writer import proctoring_log_writer
+from app.services.waiting_room_service import waiting_room_service
+from app.services.streaming_service import streaming_manager
 
 router = APIRouter()
 
-# In-memory waiting room storage (in production, use Redis)
-waiting_room = {}  # {test_id: {student_id: {status, violations, timestamp}}}
-
 class WaitingRoomAction(BaseModel):
     student_id: int
     action: str  # 'admit', 'pause', 'terminate'
     
+class StreamLoggingUpdate(BaseModel):
+    debug: bool
+    sample_every: Optional[int] = None
+    
 class ViolationReport(BaseModel):
     attempt_id: int
     violation_type: str
@@ -49,26 +55,53 @@ async def analyze_frame(
             detail="Not authorized"
         )
     
-    analysis = await proctoring_service.analyze_frame(request.frame_base64)
-    
-    for violation in analysis["violations"]:
-        log = ProctoringLog(
-            attempt_id=request.attempt_id,
-            student_id=user.id,
-            violation_type=violation["type"],
-            severity=violation["severity"],
-            description=violation["description"],
-            log_metadata={
-                "face_count": analysis["face_count"],
-                "head_pose": analysis["head_pose"],
-                "gaze_direction": analysis["gaze_direction"],
-            }
+    analysis = await proctoring_service.analyze_frame(
+        request.frame_base64,
+        attempt_id=request.attempt_id
+    )
+    
+    # Consecutive identical violations are merged and written as one episode
+    await violation_aggregator.observe(request.attempt_id, user.id, analysis)
+    
+    return analysis
+
+@router.post("/analyze-frame-binary")
+async def analyze_frame_binary(
+    attempt_id: int = Form(...),
+    frame: UploadFile = File(...),
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Analyze a raw JPEG/WebP frame sent as multipart - no base64 or JSON overhead"""
+    
+    result = await db.execute(
+        select(TestAttempt).where(TestAttempt.id == attempt_id)
+    )
+    attempt = result.scalar_one_or_none()
+    
+    if not attempt:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Test attempt not found"
+        )
+    
+    if attempt.student_id != user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized"
+        )
+    
+    frame_bytes = await frame.read()
+    
+    if len(frame_bytes) > settings.MAX_UPLOAD_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Frame too large"
         )
-        db.add(log)
-        attempt.proctoring_violations += 1
     
-    if analysis["violations"]:
-        await db.flush()
+    analysis = await proctoring_service.analyze_frame(frame_bytes, attempt_id=attempt_id)
+    
+    await violation_aggregator.observe(attempt_id, user.id, analysis)
     
     return analysis
 
@@ -149,12 +182,8 @@ async def send_to_waiting_room(
     # Get test_id from attempt
     test_id = attempt.test_id
     
-    # Initialize test waiting room if doesn't exist
-    if test_id not in waiting_room:
-        waiting_room[test_id] = {}
-    
-    # Add student to waiting room
-    waiting_room[test_id][user.id] = {
+    # Add student to waiting room (shared across workers via Redis)
+    student_data = {
         'student_id': user.id,
         'student_name': user.full_name,
         'student_number': user.student_id,
@@ -167,6 +196,7 @@ async def send_to_waiting_room(
         'paused': False,
         'test_state': None  # Will store answers when paused
     }
+    await waiting_room_service.add_student(test_id, student_data)
     
     # Log the severe violation
     log = ProctoringLog(
@@ -185,7 +215,7 @@ async def send_to_waiting_room(
     return {
         "status": "sent_to_waiting_room",
         "message": f"Excessive violations detected. Total score: {report.violation_score}",
-        "waiting_room_status": waiting_room[test_id][user.id]
+        "waiting_room_status": student_data
     }
 
 @router.get("/waiting-room/{test_id}")
@@ -199,11 +229,8 @@ async def get_waiting_room(
     if user.role != "teacher":
         raise HTTPException(status_code=403, detail="Teachers only")
     
-    if test_id not in waiting_room:
-        return {"students": []}
-    
     return {
-        "students": list(waiting_room[test_id].values())
+        "students": await waiting_room_service.get_students(test_id)
     }
 
 @router.get("/waiting-room-status/{test_id}/{student_id}")
@@ -218,15 +245,39 @@ async def check_waiting_room_status(
     if user.id != student_id and user.role != "teacher":
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    if test_id not in waiting_room or student_id not in waiting_room[test_id]:
+    student_data = await waiting_room_service.get_student(test_id, student_id)
+    
+    if not student_data:
         return {"in_waiting_room": False, "status": None}
     
     return {
         "in_waiting_room": True,
-        "status": waiting_room[test_id][student_id]['status'],
-        "details": waiting_room[test_id][student_id]
+        "status": student_data['status'],
+        "details": student_data
     }
 
+@router.get("/waiting-room-status/{test_id}/{student_id}/wait")
+async def wait_for_waiting_room_status(
+    test_id: int,
+    student_id: int,
+    since: Optional[str] = None,
+    timeout: Optional[int] = None,
+    user_id: int = Depends(get_current_user_id)
+):
+    """
+    Long-poll fallback for clients without a socket: held open until the
+    student's status differs from `since` or the timeout passes. Only the
+    token is checked, so a waiting student costs no database queries.
+    """
+    
+    if user_id != student_id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    max_timeout = settings.WAITING_ROOM_LONG_POLL_TIMEOUT
+    timeout = max_timeout if timeout is None else max(0, min(timeout, max_timeout))
+    
+    return await waiting_room_service.wait_for_change(test_id, student_id, since, timeout)
+
 @router.post("/teacher-action/{test_id}")
 async def teacher_waiting_room_action(
     test_id: int,
@@ -239,21 +290,23 @@ async def teacher_waiting_room_action(
     if user.role != "teacher":
         raise HTTPException(status_code=403, detail="Teachers only - Supreme power!")
     
-    if test_id not in waiting_room or action.student_id not in waiting_room[test_id]:
-        raise HTTPException(status_code=404, detail="Student not in waiting room")
+    student_data = await waiting_room_service.get_student(test_id, action.student_id)
     
-    student_data = waiting_room[test_id][action.student_id]
+    if not student_data:
+        raise HTTPException(status_code=404, detail="Student not in waiting room")
     
     if action.action == "admit":
         # Let student back in
-        student_data['status'] = 'admitted'
-        student_data['paused'] = False
+        student_data = await waiting_room_service.update_student(
+            test_id, action.student_id, status='admitted', paused=False
+        )
         message = f"Teacher admitted student back into test"
         
     elif action.action == "pause":
         # Pause student's test
-        student_data['status'] = 'paused'
-        student_data['paused'] = True
+        student_data = await waiting_room_service.update_student(
+            test_id, action.student_id, status='paused', paused=True
+        )
         message = f"Teacher paused student's test"
         
     elif action.action == "terminate":
@@ -272,12 +325,16 @@ async def teacher_waiting_room_action(
             await db.commit()
         
         # Remove from waiting room
-        del waiting_room[test_id][action.student_id]
+        await waiting_room_service.remove_student(test_id, action.student_id, student_data)
         message = f"Teacher terminated student's test"
         
     else:
         raise HTTPException(status_code=400, detail="Invalid action")
     
+    if student_data is None:
+        # Terminated by someone else while this action was in flight
+        raise HTTPException(status_code=404, detail="Student not in waiting room")
+    
     print(f"👨‍🏫 TEACHER ACTION: {action.action.upper()} student {action.student_id} in test {test_id}")
     
     return {
@@ -306,16 +363,53 @@ async def report_violation(
     if attempt.student_id != user.id:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    # Log violation
-    log = ProctoringLog(
+    # Log violation - the row and the counter increment are written in bulk
+    await proctoring_log_writer.write(
         attempt_id=report.attempt_id,
         student_id=user.id,
         violation_type=report.violation_type,
         severity=report.severity,
         description=report.details
     )
-    db.add(log)
-    attempt.proctoring_violations += 1
-    await db.commit()
     
-    return {"status": "logged", "total_violations": attempt.proctoring_violations}
+    return {"status": "logged", "total_violations": (attempt.proctoring_violations or 0) + 1}
+
+@router.get("/writer-metrics")
+async def get_writer_metrics(user: User = Depends(get_current_user)):
+    """Proctoring log writer queue depth and flush latency"""
+    
+    if user.role not in ["teacher", "admin"]:
+        raise HTTPException(status_code=403, detail="Teachers only")
+    
+    return proctoring_log_writer.get_metrics()
+
+@router.get("/stream-metrics")
+async def get_stream_metrics(user: User = Depends(get_current_user)):
+    """Student video relay, mosaic, alert batching and per-event counters"""
+    
+    if user.role not in ["teacher", "admin"]:
+        raise HTTPException(status_code=403, detail="Teachers only")
+    
+    return {
+        "relay": streaming_manager.frame_relay.get_metrics(),
+        "mosaic": streaming_manager.mosaic.get_metrics(),
+        "alerts": streaming_manager.teacher_outbox.get_metrics(),
+        "logging": streaming_manager.events.get_metrics()
+    }
+
+@router.post("/stream-logging")
+async def set_stream_logging(
+    update: StreamLoggingUpdate,
+    user: User = Depends(get_current_user)
+):
+    """
+    Turn per-packet streaming debug logs on or off without a restart. Only
+    the worker that serves this request is switched.
+    """
+    
+    if user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admins only")
+    
+    streaming_manager.set_debug_logging(update.debug, update.sample_every)
+    
+    return streaming_manager.events.get_metrics()
@@ -5,6 +5,8 @@ from fastapi import APIRouter, Depends
 from app.core.security import get_current_user
 from app.models import User
 from app.services.queue_service import queue_service
+from app.services.ai_rate_limiter import ai_rate_limiter
+from app.services.ai_cache import ai_cache
 
 router = APIRouter()
 
@@ -12,35 +14,31 @@ router = APIRouter()
 async def get_queue_status(user: User = Depends(get_current_user)):
     """Get current queue status and system load"""
     
-    ai_queue_length = await queue_service.get_queue_length(queue_service.AI_GENERATION_QUEUE)
-    test_queue_length = await queue_service.get_queue_length(queue_service.TEST_PROCESSING_QUEUE)
-    proctoring_queue_length = await queue_service.get_queue_length(queue_service.PROCTORING_QUEUE)
+    queues = {
+        "ai_generation": queue_service.AI_GENERATION_QUEUE,
+        "test_processing": queue_service.TEST_PROCESSING_QUEUE,
+        "proctoring": queue_service.PROCTORING_QUEUE
+    }
+    
+    # One pipelined round trip for every queue
+    stats = await queue_service.get_queue_stats(list(queues.values()))
+    
+    status = {}
+    for name, queue_name in queues.items():
+        capacity = queue_service.get_capacity(queue_name)
+        status[name] = {
+            "queued": stats[queue_name]["queued"],
+            "processing": stats[queue_name]["processing"],
+            "capacity": capacity,
+            "available_slots": max(0, capacity - stats[queue_name]["processing"])
+        }
     
-    ai_active = await queue_service.get_active_count(queue_service.AI_GENERATION_QUEUE)
-    test_active = await queue_service.get_active_count(queue_service.TEST_PROCESSING_QUEUE)
-    proctoring_active = await queue_service.get_active_count(queue_service.PROCTORING_QUEUE)
+    ai_active = status["ai_generation"]["processing"]
     
     return {
-        "queues": {
-            "ai_generation": {
-                "queued": ai_queue_length,
-                "processing": ai_active,
-                "capacity": queue_service.MAX_CONCURRENT_AI_TASKS,
-                "available_slots": max(0, queue_service.MAX_CONCURRENT_AI_TASKS - ai_active)
-            },
-            "test_processing": {
-                "queued": test_queue_length,
-                "processing": test_active,
-                "capacity": queue_service.MAX_CONCURRENT_TEST_TASKS,
-                "available_slots": max(0, queue_service.MAX_CONCURRENT_TEST_TASKS - test_active)
-            },
-            "proctoring": {
-                "queued": proctoring_queue_length,
-                "processing": proctoring_active,
-                "capacity": queue_service.MAX_CONCURRENT_PROCTORING,
-                "available_slots": max(0, queue_service.MAX_CONCURRENT_PROCTORING - proctoring_active)
-            }
-        },
+        "queues": status,
+        "ai_rate_limit": ai_rate_limiter.get_metrics(),
+        "ai_cache": ai_cache.get_metrics(),
         "system_status": "operational" if ai_active < queue_service.MAX_CONCURRENT_AI_TASKS else "busy"
     }
 
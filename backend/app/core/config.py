@@ -24,6 +24,75 @@ class Settings(BaseSettings):
     PROCTORING_LOGS_DIR: Path = Path("proctoring_logs")
     MAX_UPLOAD_SIZE: int = 10 * 1024 * 1024
     
+    # Proctoring frame analysis worker pool
+    PROCTORING_WORKERS: int = 2
+    PROCTORING_USE_PROCESSES: bool = True
+    PROCTORING_BATCH_SIZE: int = 16
+    PROCTORING_BATCH_WINDOW_MS: int = 20
+    PROCTORING_MAX_PENDING_FRAMES: int = 1000
+    PROCTORING_TRACK_REDETECT_EVERY: int = 10
+    PROCTORING_TRACK_TTL_SECONDS: int = 60
+    PROCTORING_ANALYSIS_WIDTH: int = 640
+    PROCTORING_DETECTOR: str = "haar"  # haar | dnn
+    PROCTORING_DNN_MODEL_PATH: str = "models/res10_300x300_ssd_iter_140000.caffemodel"
+    PROCTORING_DNN_CONFIG_PATH: str = "models/deploy.prototxt"
+    PROCTORING_DNN_CONFIDENCE: float = 0.6
+    
+    # Consecutive identical violations are merged into one logged episode
+    PROCTORING_VIOLATION_IDLE_SECONDS: int = 5
+    PROCTORING_VIOLATION_MAX_WINDOW_SECONDS: int = 60
+    PROCTORING_VIOLATION_FLUSH_INTERVAL_SECONDS: int = 2
+    
+    # Buffered bulk writer for proctoring_logs
+    PROCTORING_LOG_BATCH_SIZE: int = 500
+    PROCTORING_LOG_FLUSH_INTERVAL_MS: int = 250
+    PROCTORING_LOG_MAX_QUEUE: int = 50000
+    
+    # Route Socket.IO through Redis so teachers and students may sit on different workers
+    STREAMING_CLUSTERED: bool = False
+    # Student video relay: frames per second per viewer, and how long to wait for a viewer's ack
+    STREAMING_MAX_VIEWER_FPS: float = 5
+    STREAMING_FRAME_ACK_TIMEOUT: float = 2.0
+    # Teacher mosaic: one composited grid of student thumbnails per tick
+    STREAMING_MOSAIC_FPS: float = 1
+    STREAMING_MOSAIC_TILE_WIDTH: int = 160
+    STREAMING_MOSAIC_TILE_HEIGHT: int = 120
+    STREAMING_MOSAIC_JPEG_QUALITY: int = 70
+    STREAMING_MOSAIC_WORKERS: int = 2
+    # Per-connection student sessions: recent violations kept, and idle sweep
+    STREAMING_VIOLATION_HISTORY: int = 20
+    STREAMING_SESSION_IDLE_SECONDS: int = 600
+    STREAMING_SESSION_SWEEP_INTERVAL_SECONDS: int = 60
+    # Non-critical violation alerts are sent to teachers in batches
+    STREAMING_ALERT_BATCH_INTERVAL_MS: int = 250
+    STREAMING_ALERT_MAX_BATCH: int = 500
+    # Streaming logs: per-packet debug output off, and 1 in N events of each type logged
+    STREAMING_DEBUG_LOGGING: bool = False
+    STREAMING_LOG_SAMPLE_EVERY: int = 100
+    
+    # Groq budgets shared by every worker through Redis. Batch calls leave the
+    # reserved share to interactive ones and wait up to the limit for budget
+    GROQ_REQUESTS_PER_MINUTE: int = 30
+    GROQ_TOKENS_PER_MINUTE: int = 30000
+    GROQ_MAX_CONCURRENT: int = 3
+    GROQ_INTERACTIVE_RESERVE: float = 0.2
+    GROQ_LIMITER_MAX_WAIT_SECONDS: int = 30
+    # Queued generation has no request waiting on it, so it waits much longer
+    GROQ_QUEUED_MAX_WAIT_SECONDS: int = 900
+    GROQ_RATE_LIMIT_RETRIES: int = 3
+    
+    # Opt-in cache of identical AI requests, shared through Redis
+    AI_CACHE_TTL_SECONDS: int = 24 * 3600
+    AI_CACHE_MAX_ENTRIES: int = 5000
+    
+    # Long materials are processed in chunks of this many tokens (~4 chars each)
+    AI_MATERIAL_CHUNK_TOKENS: int = 750
+    # Average section size when summarizing materials too long for one prompt
+    AI_SUMMARY_CHUNK_TOKENS: int = 1500
+    
+    # Waiting-room long-poll fallback (seconds a request may be held open)
+    WAITING_ROOM_LONG_POLL_TIMEOUT: int = 25
+    
     @field_validator('CORS_ORIGINS', mode='before')
     @classmethod
     def parse_cors_origins(cls, v):
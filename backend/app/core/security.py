@@ -36,20 +36,26 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-async def get_current_user_id(token: str = Depends(oauth2_scheme)) -> int:
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+def decode_user_id(token: Optional[str]) -> Optional[int]:
+    """User id of a valid access token, or None"""
+    if not token:
+        return None
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        user_id: int = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-        return int(user_id)
-    except JWTError:
-        raise credentials_exception
+        user_id = payload.get("sub")
+        return int(user_id) if user_id is not None else None
+    except (JWTError, ValueError):
+        return None
+
+async def get_current_user_id(token: str = Depends(oauth2_scheme)) -> int:
+    user_id = decode_user_id(token)
+    if user_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user_id
 
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
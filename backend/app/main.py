@@ -1,5 +1,6 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 from pathlib import Path
@@ -9,6 +10,11 @@ from app.core.database import init_db, close_db
 from app.api import auth, tests, questions, ai, proctoring, queue, ai_materials
 from app.services.streaming_service import streaming_manager
 from app.services.queue_service import queue_service
+from app.services.proctoring_service import proctoring_service
+from app.services.violation_aggregator import violation_aggregator
+from app.services.proctoring_log_writer import proctoring_log_writer
+from app.services.course_pipeline import course_pipeline
+from app.services.ai_rate_limiter import AIRateLimitError
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -26,9 +32,25 @@ async def lifespan(app: FastAPI):
     await queue_service.connect()
     print("Queue service connected")
     
+    await proctoring_service.start()
+    await proctoring_log_writer.start()
+    await violation_aggregator.start()
+    print("Proctoring workers started")
+    
+    await streaming_manager.start()
+    print("Waiting room push relay started")
+    
+    await course_pipeline.start()
+    print("AI generation worker started")
+    
     yield
     
     print("Shutting down...")
+    await course_pipeline.stop()
+    await streaming_manager.stop()
+    await proctoring_service.stop()
+    await violation_aggregator.stop()
+    await proctoring_log_writer.stop()
     await queue_service.disconnect()
     await close_db()
 
@@ -40,6 +62,15 @@ app = FastAPI(
     redoc_url="/redoc"
 )
 
+@app.exception_handler(AIRateLimitError)
+async def ai_rate_limit_handler(request: Request, exc: AIRateLimitError):
+    """Groq budget ran out: tell the client when to come back instead of a 500"""
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Allow all origins for Granian compatibility
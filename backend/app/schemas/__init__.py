@@ -144,6 +144,7 @@ class AIContentRequest(BaseModel):
     topic: str
     content_type: str
     difficulty: Optional[str] = "medium"
+    force_fresh: bool = False
 
 class AIContentResponse(BaseModel):
     id: int
@@ -159,6 +160,7 @@ class AIQuizGenerate(BaseModel):
     topic: str
     num_questions: int = 5
     difficulty: str = "medium"
+    force_fresh: bool = False
 
 class AIQuizResponse(BaseModel):
     topic: str
@@ -0,0 +1,96 @@
+"""
+AI Response Cache
+Content-addressed cache for Groq completions. The key is a hash of the
+model, the messages and the sampling parameters, so identical requests from
+any teacher or worker are answered from Redis without a Groq call. Entries
+expire after a TTL and the least recently used ones are evicted beyond
+AI_CACHE_MAX_ENTRIES
+"""
+import hashlib
+import json
+import time
+from typing import Dict, Any, List, Optional
+from app.core.config import settings
+from app.services.queue_service import queue_service
+
+class AICache:
+    def __init__(self):
+        self.ENTRY_PREFIX = "ai_cache:entry"
+        self.LRU_KEY = "ai_cache:lru"
+        self.ttl = settings.AI_CACHE_TTL_SECONDS
+        self.max_entries = settings.AI_CACHE_MAX_ENTRIES
+        
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stores = 0
+        self.evictions = 0
+        self.errors = 0
+    
+    def make_key(self, model: str, messages: List[Dict[str, str]], **params) -> str:
+        payload = json.dumps(
+            {"model": model, "messages": messages, "params": params},
+            sort_keys=True,
+            separators=(",", ":")
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def _entry_key(self, key: str) -> str:
+        return f"{self.ENTRY_PREFIX}:{key}"
+    
+    async def get(self, key: str) -> Optional[str]:
+        try:
+            await queue_service.connect()
+            async with queue_service.redis_client.pipeline(transaction=False) as pipe:
+                pipe.get(self._entry_key(key))
+                pipe.zadd(self.LRU_KEY, {key: time.time()}, xx=True)
+                value, _ = await pipe.execute()
+        except Exception as e:
+            self.errors += 1
+            print(f"AI cache read error: {e}")
+            return None
+        
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+    
+    async def set(self, key: str, value: str):
+        now = time.time()
+        try:
+            await queue_service.connect()
+            redis_client = queue_service.redis_client
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.set(self._entry_key(key), value, ex=self.ttl)
+                pipe.zadd(self.LRU_KEY, {key: now})
+                # Not read for a whole TTL means the entry has already expired
+                pipe.zremrangebyscore(self.LRU_KEY, "-inf", now - self.ttl)
+                pipe.zcard(self.LRU_KEY)
+                results = await pipe.execute()
+            self.stores += 1
+            
+            overflow = results[-1] - self.max_entries
+            if overflow > 0:
+                evicted = await redis_client.zpopmin(self.LRU_KEY, overflow)
+                if evicted:
+                    await redis_client.delete(*(self._entry_key(member) for member, _ in evicted))
+                    self.evictions += len(evicted)
+        except Exception as e:
+            self.errors += 1
+            print(f"AI cache write error: {e}")
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "bypassed": self.bypassed,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "errors": self.errors
+        }
+
+ai_cache = AICache()
@@ -0,0 +1,214 @@
+"""
+AI Rate Limiter
+Shares the Groq request-per-minute and token-per-minute budgets, and a cap
+on in-flight calls, between every worker through Redis. Calls wait briefly
+for budget instead of being sent into a 429; batch calls (course and
+question generation) leave a reserved share of each budget to interactive
+ones (concept explanations, tutoring)
+"""
+import asyncio
+import math
+import random
+import time
+import uuid
+from typing import Dict, Any, Optional
+from app.core.config import settings
+from app.services.queue_service import queue_service
+
+# Refill both token buckets, then take one request and the estimated tokens
+# and an in-flight slot if all are available. Returns "0" when granted, or
+# the seconds to wait before trying again.
+# KEYS[1] bucket hash, KEYS[2] in-flight slots, KEYS[3] pause flag
+# ARGV[1] now, ARGV[2] requests/min, ARGV[3] tokens/min, ARGV[4] slots
+# usable by this call, ARGV[5] estimated tokens, ARGV[6] share of each
+# bucket to leave untouched, ARGV[7] slot id, ARGV[8] slot lease seconds
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local rpm = tonumber(ARGV[2])
+local tpm = tonumber(ARGV[3])
+local slots = tonumber(ARGV[4])
+local cost = math.min(tonumber(ARGV[5]), tpm)
+local reserve = tonumber(ARGV[6])
+
+local state = redis.call('HMGET', KEYS[1], 'requests', 'tokens', 'ts')
+local requests = tonumber(state[1]) or rpm
+local tokens = tonumber(state[2]) or tpm
+local elapsed = math.max(0, now - (tonumber(state[3]) or now))
+requests = math.min(rpm, requests + elapsed * rpm / 60)
+tokens = math.min(tpm, tokens + elapsed * tpm / 60)
+
+local wait = 0
+local paused = redis.call('PTTL', KEYS[3])
+if paused > 0 then
+    wait = paused / 1000
+end
+
+local need_requests = 1 + rpm * reserve
+if requests < need_requests then
+    wait = math.max(wait, (need_requests - requests) * 60 / rpm)
+end
+local need_tokens = cost + tpm * reserve
+if tokens < need_tokens then
+    wait = math.max(wait, (need_tokens - tokens) * 60 / tpm)
+end
+
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+if redis.call('ZCARD', KEYS[2]) >= slots then
+    wait = math.max(wait, 0.1)
+end
+
+if wait == 0 then
+    requests = requests - 1
+    tokens = tokens - cost
+    redis.call('ZADD', KEYS[2], now + tonumber(ARGV[8]), ARGV[7])
+end
+
+redis.call('HSET', KEYS[1], 'requests', requests, 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 120)
+return tostring(wait)
+"""
+
+# Free an in-flight slot and settle the token estimate against actual usage
+# KEYS[1] bucket hash, KEYS[2] in-flight slots
+# ARGV[1] slot id, ARGV[2] tokens to give back (negative to charge more),
+# ARGV[3] tokens/min
+RELEASE_SCRIPT = """
+redis.call('ZREM', KEYS[2], ARGV[1])
+local refund = tonumber(ARGV[2])
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+if refund ~= 0 and tokens then
+    redis.call('HSET', KEYS[1], 'tokens', math.min(tonumber(ARGV[3]), tokens + refund))
+end
+return 1
+"""
+
+class AIRateLimitError(Exception):
+    """Raised when no Groq budget became available within the wait limit"""
+    
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class AIRateLimiter:
+    def __init__(self):
+        self.BUCKET_KEY = "groq:limiter:bucket"
+        self.SLOTS_KEY = "groq:limiter:slots"
+        self.PAUSE_KEY = "groq:limiter:paused"
+        # A slot is freed after this long even if its worker never released it
+        self.SLOT_LEASE_SECONDS = 120
+        self.MAX_POLL_SECONDS = 1.0
+        
+        self.requests_per_minute = settings.GROQ_REQUESTS_PER_MINUTE
+        self.tokens_per_minute = settings.GROQ_TOKENS_PER_MINUTE
+        self.max_concurrent = settings.GROQ_MAX_CONCURRENT
+        self.interactive_reserve = settings.GROQ_INTERACTIVE_RESERVE
+        self.max_wait = settings.GROQ_LIMITER_MAX_WAIT_SECONDS
+        
+        self._acquire_script = None
+        self._release_script = None
+        
+        # Metrics
+        self.granted = {"interactive": 0, "batch": 0}
+        self.delayed = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+        self.pauses = 0
+    
+    async def _connect(self):
+        await queue_service.connect()
+        if not self._acquire_script:
+            self._acquire_script = queue_service.redis_client.register_script(ACQUIRE_SCRIPT)
+            self._release_script = queue_service.redis_client.register_script(RELEASE_SCRIPT)
+    
+    async def acquire(
+        self,
+        estimated_tokens: int,
+        interactive: bool = False,
+        max_wait: Optional[float] = None
+    ) -> str:
+        """
+        Wait until a request, the estimated tokens and an in-flight slot are
+        available and take them. Returns the slot id to pass to release().
+        max_wait overrides GROQ_LIMITER_MAX_WAIT_SECONDS for this call.
+        """
+        if max_wait is None:
+            max_wait = self.max_wait
+        
+        await self._connect()
+        
+        if interactive:
+            reserve = 0
+            slots = self.max_concurrent
+        else:
+            reserve = self.interactive_reserve
+            slots = max(1, self.max_concurrent - math.ceil(self.max_concurrent * reserve))
+        
+        slot_id = uuid.uuid4().hex
+        started = time.monotonic()
+        delayed = False
+        
+        while True:
+            wait = float(await self._acquire_script(
+                keys=[self.BUCKET_KEY, self.SLOTS_KEY, self.PAUSE_KEY],
+                args=[
+                    time.time(),
+                    self.requests_per_minute,
+                    self.tokens_per_minute,
+                    slots,
+                    estimated_tokens,
+                    reserve,
+                    slot_id,
+                    self.SLOT_LEASE_SECONDS
+                ]
+            ))
+            
+            waited = time.monotonic() - started
+            if wait == 0:
+                self.granted["interactive" if interactive else "batch"] += 1
+                if delayed:
+                    self.delayed += 1
+                    self.wait_seconds += waited
+                return slot_id
+            
+            if waited + wait > max_wait:
+                self.timeouts += 1
+                retry_after = int(wait) + 1
+                raise AIRateLimitError(
+                    f"AI service is busy, please try again in {retry_after} seconds",
+                    retry_after
+                )
+            
+            delayed = True
+            # Interactive callers poll a little sooner so they win the next slot
+            poll = min(wait, self.MAX_POLL_SECONDS) * (0.5 if interactive else 1)
+            await asyncio.sleep(poll + random.uniform(0, 0.05))
+    
+    async def release(self, slot_id: str, estimated_tokens: int, actual_tokens: Optional[int] = None):
+        """Free the slot; actual_tokens=None gives the whole estimate back"""
+        await self._connect()
+        charged = min(estimated_tokens, self.tokens_per_minute)
+        await self._release_script(
+            keys=[self.BUCKET_KEY, self.SLOTS_KEY],
+            args=[slot_id, charged - (actual_tokens or 0), self.tokens_per_minute]
+        )
+    
+    async def pause(self, seconds: float):
+        """Hold every worker's calls after Groq answered with a 429"""
+        await self._connect()
+        self.pauses += 1
+        await queue_service.redis_client.set(self.PAUSE_KEY, 1, px=max(1, int(seconds * 1000)))
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        delayed = self.delayed
+        return {
+            "requests_per_minute": self.requests_per_minute,
+            "tokens_per_minute": self.tokens_per_minute,
+            "max_concurrent": self.max_concurrent,
+            "granted": dict(self.granted),
+            "delayed": delayed,
+            "avg_wait_seconds": round(self.wait_seconds / delayed, 3) if delayed else 0.0,
+            "timeouts": self.timeouts,
+            "pauses": self.pauses
+        }
+
+ai_rate_limiter = AIRateLimiter()
@@ -1,22 +1,250 @@
+import asyncio
 import json
-from typing import List, Dict, Any, Optional
-from groq import AsyncGroq
+import random
+import re
+from typing import List, Dict, Any, Optional, Callable, AsyncIterator
+from groq import AsyncGroq, APIConnectionError, APIStatusError, RateLimitError
 from app.core.config import settings
+from app.services.ai_rate_limiter import ai_rate_limiter
+from app.services.ai_cache import ai_cache
+from app.services.text_chunker import CHARS_PER_TOKEN, chunk_text, content_defined_chunks
 
 class AIService:
     def __init__(self):
-        self.client = AsyncGroq(api_key=settings.GROQ_API_KEY)
+        # Retries are done by _chat and _chat_stream: 429s through the shared
+        # limiter, connection errors, timeouts and 5xx with a short backoff
+        self.client = AsyncGroq(api_key=settings.GROQ_API_KEY, max_retries=0)
         self.model = "llama-3.3-70b-versatile"
+        # Longer materials are summarized section by section
+        self.SUMMARY_SINGLE_PASS_CHARS = 8000
+        self.SECTION_SUMMARY_TOKENS = 500
+    
+    async def _chat(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        interactive: bool = False,
+        max_wait: Optional[float] = None,
+        **kwargs
+    ):
+        """
+        Send a chat completion through the shared Groq limiter. A 429 pauses
+        every worker for the advertised time and the call is retried;
+        transient errors are retried after a backoff, without the slot.
+        max_wait bounds the wait for budget (see AIRateLimiter.acquire).
+        """
+        estimated_tokens = self._estimate_tokens(messages) + max_tokens
+        
+        for attempt in range(settings.GROQ_RATE_LIMIT_RETRIES + 1):
+            slot_id = await ai_rate_limiter.acquire(
+                estimated_tokens, interactive=interactive, max_wait=max_wait
+            )
+            used_tokens = None
+            backoff = 0.0
+            try:
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    **kwargs
+                )
+                if response.usage:
+                    used_tokens = response.usage.total_tokens
+                return response
+            except RateLimitError as e:
+                if attempt == settings.GROQ_RATE_LIMIT_RETRIES:
+                    raise
+                await ai_rate_limiter.pause(self._retry_after(e, attempt))
+            except (APIConnectionError, APIStatusError) as e:
+                if not self._is_transient(e) or attempt == settings.GROQ_RATE_LIMIT_RETRIES:
+                    raise
+                backoff = self._backoff(attempt)
+            finally:
+                await ai_rate_limiter.release(slot_id, estimated_tokens, used_tokens)
+            
+            if backoff:
+                print(f"Groq call failed, retrying in {backoff:.1f}s")
+                await asyncio.sleep(backoff)
+    
+    async def _chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        interactive: bool = False
+    ) -> AsyncIterator[str]:
+        """
+        Stream a chat completion through the shared Groq limiter, yielding
+        text as it arrives. 429s and transient errors are retried as in
+        _chat, but only before the first chunk was yielded.
+        """
+        prompt_tokens = self._estimate_tokens(messages)
+        estimated_tokens = prompt_tokens + max_tokens
+        
+        for attempt in range(settings.GROQ_RATE_LIMIT_RETRIES + 1):
+            slot_id = await ai_rate_limiter.acquire(estimated_tokens, interactive=interactive)
+            used_tokens = None
+            streamed_chars = 0
+            backoff = 0.0
+            try:
+                stream = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=True
+                )
+                async for chunk in stream:
+                    # Groq reports usage on the last chunk
+                    usage = getattr(getattr(chunk, "x_groq", None), "usage", None)
+                    if usage:
+                        used_tokens = usage.total_tokens
+                    
+                    text = chunk.choices[0].delta.content if chunk.choices else None
+                    if text:
+                        streamed_chars += len(text)
+                        yield text
+                return
+            except RateLimitError as e:
+                if attempt == settings.GROQ_RATE_LIMIT_RETRIES:
+                    raise
+                await ai_rate_limiter.pause(self._retry_after(e, attempt))
+            except (APIConnectionError, APIStatusError) as e:
+                # Text already sent to the caller cannot be taken back
+                if streamed_chars or not self._is_transient(e) or attempt == settings.GROQ_RATE_LIMIT_RETRIES:
+                    raise
+                backoff = self._backoff(attempt)
+            finally:
+                if used_tokens is None and streamed_chars:
+                    # Stream cut short (client went away): charge what was produced
+                    used_tokens = prompt_tokens + streamed_chars // 4
+                await ai_rate_limiter.release(slot_id, estimated_tokens, used_tokens)
+            
+            if backoff:
+                print(f"Groq stream failed, retrying in {backoff:.1f}s")
+                await asyncio.sleep(backoff)
+    
+    def _estimate_tokens(self, messages: List[Dict[str, str]]) -> int:
+        # Roughly 4 characters per token
+        return sum(len(message["content"]) for message in messages) // 4
+    
+    def _is_transient(self, error: Exception) -> bool:
+        """Errors the Groq SDK would retry itself: connection errors, timeouts, 408, 409 and 5xx"""
+        if isinstance(error, APIConnectionError):
+            return True
+        return isinstance(error, APIStatusError) and (
+            error.status_code in (408, 409) or error.status_code >= 500
+        )
+    
+    def _backoff(self, attempt: int) -> float:
+        # Same schedule as the SDK: 0.5s doubling up to 8s, with jitter
+        return min(8.0, 0.5 * 2 ** attempt) * random.uniform(0.75, 1.0)
+    
+    def _retry_after(self, error: RateLimitError, attempt: int) -> float:
+        try:
+            return float(error.response.headers.get("retry-after"))
+        except (AttributeError, TypeError, ValueError):
+            return float(2 ** attempt)
+    
+    async def _complete(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        interactive: bool = False,
+        use_cache: bool = False,
+        force_fresh: bool = False,
+        cacheable: Optional[Callable[[str], bool]] = None,
+        **kwargs
+    ) -> str:
+        """
+        Completion text, answered from the response cache when use_cache is
+        set. force_fresh skips the lookup but still refreshes the entry;
+        cacheable can reject outputs that should not be stored.
+        """
+        if not use_cache:
+            response = await self._chat(messages, temperature, max_tokens, interactive, **kwargs)
+            return response.choices[0].message.content
+        
+        key = ai_cache.make_key(
+            self.model, messages, temperature=temperature, max_tokens=max_tokens, **kwargs
+        )
+        
+        if force_fresh:
+            ai_cache.bypassed += 1
+        else:
+            cached = await ai_cache.get(key)
+            if cached is not None:
+                return cached
+        
+        response = await self._chat(messages, temperature, max_tokens, interactive, **kwargs)
+        content = response.choices[0].message.content
+        if content and (cacheable is None or cacheable(content)):
+            await ai_cache.set(key, content)
+        return content
+    
+    def _strip_code_fence(self, content: str) -> str:
+        content = content.strip()
+        if content.startswith("```json"):
+            content = content[7:]
+        if content.startswith("```"):
+            content = content[3:]
+        if content.endswith("```"):
+            content = content[:-3]
+        return content.strip()
+    
+    def _is_json(self, content: str) -> bool:
+        try:
+            json.loads(self._strip_code_fence(content))
+            return True
+        except json.JSONDecodeError:
+            return False
     
     async def generate_course(
         self,
         topic: str,
         duration_days: int,
         difficulty: str = "medium",
-        learning_style: str = "comprehensive"
+        learning_style: str = "comprehensive",
+        use_cache: bool = False,
+        force_fresh: bool = False
     ) -> Dict[str, Any]:
         """Generate a complete course with daily lessons and assessments"""
+        content = await self._complete(
+            messages=self._course_messages(topic, duration_days, difficulty, learning_style),
+            temperature=0.7,
+            max_tokens=4000,
+            use_cache=use_cache,
+            force_fresh=force_fresh,
+            cacheable=self._is_json
+        )
         
+        return self.parse_course(content)
+    
+    async def stream_course(
+        self,
+        topic: str,
+        duration_days: int,
+        difficulty: str = "medium",
+        learning_style: str = "comprehensive"
+    ) -> AsyncIterator[str]:
+        """Stream the course JSON text as it is generated; parse it with parse_course"""
+        async for text in self._chat_stream(
+            self._course_messages(topic, duration_days, difficulty, learning_style),
+            temperature=0.7,
+            max_tokens=4000
+        ):
+            yield text
+    
+    def _course_messages(
+        self,
+        topic: str,
+        duration_days: int,
+        difficulty: str,
+        learning_style: str
+    ) -> List[Dict[str, str]]:
         prompt = f"""Create a comprehensive {duration_days}-day course on: {topic}
 
 Difficulty Level: {difficulty}
@@ -55,36 +283,20 @@ Return ONLY a valid JSON object with this structure:
 
 Do not include any text outside the JSON object."""
 
-        response = await self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert curriculum designer and educational planner. Create structured, progressive learning paths. Always return valid JSON only."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            temperature=0.7,
-            max_tokens=4000
-        )
-        
-        content = response.choices[0].message.content.strip()
-        
-        # Clean JSON markers
-        if content.startswith("```json"):
-            content = content[7:]
-        if content.startswith("```"):
-            content = content[3:]
-        if content.endswith("```"):
-            content = content[:-3]
-        content = content.strip()
-        
+        return [
+            {
+                "role": "system",
+                "content": "You are an expert curriculum designer and educational planner. Create structured, progressive learning paths. Always return valid JSON only."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+    
+    def parse_course(self, content: str) -> Dict[str, Any]:
         try:
-            course_data = json.loads(content)
-            return course_data
+            return json.loads(self._strip_code_fence(content))
         except json.JSONDecodeError as e:
             raise ValueError(f"Failed to parse course data: {e}")
     
@@ -93,10 +305,41 @@ Do not include any text outside the JSON object."""
         topic: str,
         day_number: int,
         lesson_title: str,
-        objectives: List[str]
+        objectives: List[str],
+        max_wait: Optional[float] = None
     ) -> str:
         """Generate detailed content for a specific day's lesson"""
+        response = await self._chat(
+            self._day_content_messages(topic, day_number, lesson_title, objectives),
+            temperature=0.7,
+            max_tokens=4096,
+            max_wait=max_wait
+        )
         
+        return response.choices[0].message.content
+    
+    async def stream_day_content(
+        self,
+        topic: str,
+        day_number: int,
+        lesson_title: str,
+        objectives: List[str]
+    ) -> AsyncIterator[str]:
+        """Stream a day's lesson content as it is generated"""
+        async for text in self._chat_stream(
+            self._day_content_messages(topic, day_number, lesson_title, objectives),
+            temperature=0.7,
+            max_tokens=4096
+        ):
+            yield text
+    
+    def _day_content_messages(
+        self,
+        topic: str,
+        day_number: int,
+        lesson_title: str,
+        objectives: List[str]
+    ) -> List[Dict[str, str]]:
         objectives_text = "\n".join([f"- {obj}" for obj in objectives])
         
         prompt = f"""Create comprehensive, detailed learning content for Day {day_number} of a course on {topic}.
@@ -148,23 +391,16 @@ Suggest books, websites, or videos for further learning.
 
 Write in a clear, engaging, educational style. Make it feel like a textbook chapter that students can actually learn from."""
 
-        response = await self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert teacher and educational content creator. Write comprehensive, detailed lesson content that students can actually learn from. Write like a textbook author - thorough, clear, and educational."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            temperature=0.7,
-            max_tokens=4096
-        )
-        
-        return response.choices[0].message.content
+        return [
+            {
+                "role": "system",
+                "content": "You are an expert teacher and educational content creator. Write comprehensive, detailed lesson content that students can actually learn from. Write like a textbook author - thorough, clear, and educational."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
     
     async def generate_assessment(
         self,
@@ -172,7 +408,8 @@ Write in a clear, engaging, educational style. Make it feel like a textbook chap
         day_number: int,
         covered_topics: List[str],
         num_questions: int = 5,
-        difficulty: str = "medium"
+        difficulty: str = "medium",
+        max_wait: Optional[float] = None
     ) -> List[Dict[str, Any]]:
         """Generate assessment questions for topics covered so far"""
         
@@ -217,8 +454,7 @@ Return ONLY a valid JSON array:
   }}
 ]"""
 
-        response = await self.client.chat.completions.create(
-            model=self.model,
+        response = await self._chat(
             messages=[
                 {
                     "role": "system",
@@ -230,7 +466,8 @@ Return ONLY a valid JSON array:
                 }
             ],
             temperature=0.8,
-            max_tokens=3000
+            max_tokens=3000,
+            max_wait=max_wait
         )
         
         content = response.choices[0].message.content.strip()
@@ -254,7 +491,9 @@ Return ONLY a valid JSON array:
         self,
         topic: str,
         content_type: str,
-        difficulty: str = "medium"
+        difficulty: str = "medium",
+        use_cache: bool = False,
+        force_fresh: bool = False
     ) -> str:
         prompts = {
             "summary": f"Provide a comprehensive {difficulty}-level summary of {topic}. Include key concepts, important points, and examples.",
@@ -265,8 +504,7 @@ Return ONLY a valid JSON array:
         
         prompt = prompts.get(content_type, prompts["summary"])
         
-        response = await self.client.chat.completions.create(
-            model=self.model,
+        content = await self._complete(
             messages=[
                 {
                     "role": "system",
@@ -278,16 +516,20 @@ Return ONLY a valid JSON array:
                 }
             ],
             temperature=0.7,
-            max_tokens=2000
+            max_tokens=2000,
+            use_cache=use_cache,
+            force_fresh=force_fresh
         )
         
-        return response.choices[0].message.content
+        return content
     
     async def generate_quiz_questions(
         self,
         topic: str,
         num_questions: int = 5,
-        difficulty: str = "medium"
+        difficulty: str = "medium",
+        use_cache: bool = False,
+        force_fresh: bool = False
     ) -> List[Dict[str, Any]]:
         prompt = f"""Generate {num_questions} multiple-choice questions on the topic: {topic}
         
@@ -317,8 +559,7 @@ Return ONLY a valid JSON array with this exact structure:
 
 Do not include any explanation or text outside the JSON array."""
 
-        response = await self.client.chat.completions.create(
-            model=self.model,
+        content = await self._complete(
             messages=[
                 {
                     "role": "system",
@@ -330,10 +571,13 @@ Do not include any explanation or text outside the JSON array."""
                 }
             ],
             temperature=0.8,
-            max_tokens=3000
+            max_tokens=3000,
+            use_cache=use_cache,
+            force_fresh=force_fresh,
+            cacheable=self._is_json
         )
         
-        content = response.choices[0].message.content.strip()
+        content = content.strip()
         
         if content.startswith("```json"):
             content = content[7:]
@@ -361,13 +605,18 @@ Do not include any explanation or text outside the JSON array."""
         except json.JSONDecodeError as e:
             raise ValueError(f"Failed to parse AI response as JSON: {e}. Content: {content[:200]}")
     
-    async def explain_concept(self, concept: str, context: str = "") -> str:
+    async def explain_concept(
+        self,
+        concept: str,
+        context: str = "",
+        use_cache: bool = False,
+        force_fresh: bool = False
+    ) -> str:
         prompt = f"Explain the concept: {concept}"
         if context:
             prompt += f"\n\nContext: {context}"
         
-        response = await self.client.chat.completions.create(
-            model=self.model,
+        content = await self._complete(
             messages=[
                 {
                     "role": "system",
@@ -379,23 +628,41 @@ Do not include any explanation or text outside the JSON array."""
                 }
             ],
             temperature=0.7,
-            max_tokens=1000
+            max_tokens=1000,
+            interactive=True,
+            use_cache=use_cache,
+            force_fresh=force_fresh
         )
         
-        return response.choices[0].message.content
+        return content
     
     async def generate_questions_from_material(
         self, 
         text_content: str, 
         num_questions: int = 10, 
         difficulty: str = "medium", 
-        question_types: Optional[List[str]] = None
+        question_types: Optional[List[str]] = None,
+        chunked: bool = False,
+        type_counts: Optional[Dict[str, int]] = None
     ) -> List[Dict[str, Any]]:
-        """Generate questions from uploaded material text"""
+        """
+        Generate questions from uploaded material text. Without chunked only
+        the start of the text is used; with it the whole text is covered.
+        type_counts fixes how many questions of each type to ask for instead
+        of an even split of num_questions over question_types.
+        """
         if not question_types:
             question_types = ["mcq", "true_false", "short_answer"]
         
-        type_instructions = self._build_type_instructions(question_types, num_questions)
+        if chunked:
+            chunks = chunk_text(text_content, settings.AI_MATERIAL_CHUNK_TOKENS)
+            if len(chunks) > 1:
+                return await self._generate_questions_chunked(chunks, num_questions, difficulty, question_types)
+        
+        if type_counts:
+            type_instructions = ", ".join(f"{count} {qtype}" for qtype, count in type_counts.items() if count)
+        else:
+            type_instructions = self._build_type_instructions(question_types, num_questions)
         
         # Truncate content more aggressively to avoid token limits
         # Keep only first 3000 chars to leave room for response
@@ -408,7 +675,7 @@ Content:
 
 Requirements:
 - Difficulty: {difficulty}
-- Question types: {', '.join(question_types)}
+- Question types: {type_instructions}
 - For MCQ: provide 4 options with one correct answer
 - For True/False: use True or False as correct answer
 
@@ -440,8 +707,7 @@ Return a JSON object with a "questions" array:
             print(f"   Difficulty: {difficulty}")
             print(f"   Types: {question_types}")
             
-            response = await self.client.chat.completions.create(
-                model=self.model,
+            response = await self._chat(
                 messages=[
                     {
                         "role": "system",
@@ -523,6 +789,97 @@ Return a JSON object with a "questions" array:
             traceback.print_exc()
             raise Exception(f"Question generation failed: {str(e)}")
     
+    async def _generate_questions_chunked(
+        self,
+        chunks: List[str],
+        num_questions: int,
+        difficulty: str,
+        question_types: List[str]
+    ) -> List[Dict[str, Any]]:
+        """
+        Generate each chunk's share of the questions concurrently, then merge.
+        Questions lost to duplicates or failed chunks are asked for once more;
+        a shortfall left after that is reported, not padded.
+        """
+        print(f"🤖 Generating {num_questions} questions over {len(chunks)} chunks")
+        weights = [len(chunk) for chunk in chunks]
+        semaphore = asyncio.Semaphore(settings.GROQ_MAX_CONCURRENT)
+        
+        async def generate(chunk: str, quota: int, type_counts: Dict[str, int]) -> List[Dict[str, Any]]:
+            async with semaphore:
+                questions = await self.generate_questions_from_material(
+                    chunk, quota, difficulty, question_types, type_counts=type_counts
+                )
+                return questions[:quota]
+        
+        async def generate_round(count: int) -> List[Dict[str, Any]]:
+            # Types are dealt round-robin across chunks, so chunks asked for
+            # one or two questions still add up to the requested mix
+            dealt = [question_types[i % len(question_types)] for i in range(count)]
+            jobs = []
+            offset = 0
+            for chunk, quota in zip(chunks, self._allocate_questions(weights, count)):
+                if quota > 0:
+                    type_counts = {qtype: dealt[offset:offset + quota].count(qtype) for qtype in question_types}
+                    jobs.append(generate(chunk, quota, type_counts))
+                offset += quota
+            
+            results = await asyncio.gather(*jobs, return_exceptions=True)
+            failures = [result for result in results if isinstance(result, Exception)]
+            if len(failures) == len(results):
+                raise Exception(f"Question generation failed for every chunk: {failures[0]}")
+            if failures:
+                print(f"⚠️  {len(failures)} of {len(results)} chunks failed, continuing with the rest")
+            return [question for result in results if not isinstance(result, Exception) for question in result]
+        
+        questions = self._dedupe_questions(await generate_round(num_questions))
+        
+        shortfall = num_questions - len(questions)
+        if shortfall > 0:
+            print(f"⚠️  {shortfall} questions short after merging, asking for more")
+            try:
+                questions = self._dedupe_questions(questions + await generate_round(shortfall))
+            except Exception as e:
+                print(f"⚠️  Top-up failed: {e}")
+            if len(questions) < num_questions:
+                print(f"⚠️  Returning {len(questions)} of {num_questions} requested questions")
+        
+        return questions[:num_questions]
+    
+    def _allocate_questions(self, weights: List[int], total: int) -> List[int]:
+        """
+        Split total questions across chunks in proportion to weights by
+        largest remainder: every chunk gets the whole part of its share and
+        the questions left go to the largest fractions. Ties are staggered so
+        that, with fewer questions than chunks, they spread through the material.
+        """
+        weight_sum = sum(weights) or 1
+        shares = [weight * total / weight_sum for weight in weights]
+        quotas = [int(share) for share in shares]
+        
+        leftover = total - sum(quotas)
+        by_remainder = sorted(
+            range(len(weights)),
+            key=lambda i: (-(shares[i] - quotas[i]), (i * total) % len(weights))
+        )
+        for i in by_remainder[:leftover]:
+            quotas[i] += 1
+        return quotas
+    
+    def _dedupe_questions(self, questions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Drop questions whose wording repeats or nearly repeats an earlier one"""
+        kept = []
+        kept_words = []
+        for question in questions:
+            words = set(re.findall(r"[a-z0-9]+", str(question.get("question", "")).lower()))
+            if not words:
+                continue
+            if any(len(words & other) / len(words | other) >= 0.8 for other in kept_words):
+                continue
+            kept.append(question)
+            kept_words.append(words)
+        return kept
+    
     async def provide_study_help(self, question: str, context: str = "") -> str:
         """Provide study help for students"""
         prompt = f"""You are a helpful tutor. A student needs help with the following:
@@ -540,8 +897,7 @@ Provide:
 Keep your response concise but thorough."""
 
         try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
+            response = await self._chat(
                 messages=[
                     {
                         "role": "system",
@@ -553,7 +909,8 @@ Keep your response concise but thorough."""
                     }
                 ],
                 temperature=0.8,
-                max_tokens=1500
+                max_tokens=1500,
+                interactive=True
             )
             
             return response.choices[0].message.content
@@ -565,11 +922,81 @@ Keep your response concise but thorough."""
         """Provide a comprehensive summary of material"""
         page_info = f"Pages {pages['start']}-{pages['end']}" if pages else "Full document"
         
+        try:
+            if len(content) > self.SUMMARY_SINGLE_PASS_CHARS:
+                section_summaries = await self._summarize_sections(content)
+                return await self._complete(
+                    messages=self._summary_messages(
+                        page_info, "Summaries of consecutive sections", "\n\n".join(section_summaries)
+                    ),
+                    temperature=0.7,
+                    max_tokens=2000,
+                    use_cache=True
+                )
+            
+            return await self._complete(
+                messages=self._summary_messages(page_info, "Content", content),
+                temperature=0.7,
+                max_tokens=2000,
+                use_cache=True
+            )
+            
+        except Exception as e:
+            raise Exception(f"Summary generation failed: {str(e)}")
+    
+    async def _summarize_sections(self, content: str) -> List[str]:
+        """
+        Summarize content-defined sections in parallel, then summarize
+        content-defined groups of those summaries until they fit one prompt.
+        Every call goes through the response cache, so re-summarizing the same
+        or a lightly edited material only calls Groq for the sections, and the
+        groups at each level above them, that changed.
+        """
+        semaphore = asyncio.Semaphore(settings.GROQ_MAX_CONCURRENT)
+        
+        async def summarize(section: str) -> str:
+            async with semaphore:
+                return await self._complete(
+                    messages=[
+                        {
+                            "role": "system",
+                            "content": "You summarize one section of a longer educational document. Keep every key concept, definition and important detail; drop examples and repetition."
+                        },
+                        {
+                            "role": "user",
+                            "content": f"Summarize this section in concise bullet points:\n\n{section}"
+                        }
+                    ],
+                    temperature=0.3,
+                    max_tokens=self.SECTION_SUMMARY_TOKENS,
+                    use_cache=True
+                )
+        
+        sections = content_defined_chunks(content, settings.AI_SUMMARY_CHUNK_TOKENS)
+        print(f"📝 Summarizing {len(content)} chars in {len(sections)} sections")
+        summaries = await asyncio.gather(*(summarize(section) for section in sections))
+        
+        # A level of section summaries is still too long - summarize it again.
+        # Groups are content-defined too, so a changed summary only shifts the
+        # group it falls in. Averaging half a prompt and capped at twice that,
+        # a group always fits one prompt
+        single_pass_tokens = self.SUMMARY_SINGLE_PASS_CHARS // CHARS_PER_TOKEN
+        while len("\n\n".join(summaries)) > self.SUMMARY_SINGLE_PASS_CHARS and len(summaries) > 1:
+            level = "\n\n".join(summaries)
+            groups = content_defined_chunks(level, single_pass_tokens // 2)
+            if len(groups) >= len(summaries):
+                # No boundary merged anything, so pack greedily to make progress
+                groups = chunk_text(level, single_pass_tokens)
+            summaries = await asyncio.gather(*(summarize(group) for group in groups))
+        
+        return list(summaries)
+    
+    def _summary_messages(self, page_info: str, label: str, text: str) -> List[Dict[str, str]]:
         prompt = f"""Provide a comprehensive summary of the following material:
 
 {page_info}
-Content:
-{content[:8000]}
+{label}:
+{text[:self.SUMMARY_SINGLE_PASS_CHARS]}
 
 Your summary should include:
 1. **Main Topic/Theme**
@@ -579,27 +1006,16 @@ Your summary should include:
 
 Format your response in markdown with clear headings and bullet points."""
 
-        try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an expert at creating clear, comprehensive summaries of educational material. Always format output in markdown."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=0.7,
-                max_tokens=2000
-            )
-            
-            return response.choices[0].message.content
-            
-        except Exception as e:
-            raise Exception(f"Summary generation failed: {str(e)}")
+        return [
+            {
+                "role": "system",
+                "content": "You are an expert at creating clear, comprehensive summaries of educational material. Always format output in markdown."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
     
     def _build_type_instructions(self, question_types: List[str], num_questions: int) -> str:
         """Helper to build question type distribution"""
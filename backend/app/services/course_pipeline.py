@@ -0,0 +1,183 @@
+"""
+Course Pipeline
+Generates the lessons and assessments of a whole course outline
+concurrently, as one task on the AI generation queue. Each piece is saved
+to AIContent as soon as it is ready and recorded on the task, so progress
+can be read from /queue/task/{id} and a retried task only redoes the
+pieces that failed
+"""
+import asyncio
+import json
+from typing import Dict, Any, List, Optional
+from app.core.config import settings
+from app.core.database import async_session_maker
+from app.models import AIContent
+from app.services.ai_service import ai_service
+from app.services.queue_service import queue_service
+
+class CoursePipeline:
+    def __init__(self):
+        self.queue_name = queue_service.AI_GENERATION_QUEUE
+        # Pieces in flight per task; the shared Groq limiter still applies
+        self.max_parallel = settings.GROQ_MAX_CONCURRENT
+        self._worker: Optional[asyncio.Task] = None
+    
+    async def start(self):
+        if not self._worker:
+            self._worker = asyncio.create_task(
+                queue_service.process_queue(self.queue_name, self.process)
+            )
+    
+    async def stop(self):
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+    
+    async def submit(
+        self,
+        user_id: int,
+        topic: str,
+        course: Dict[str, Any],
+        difficulty: str = "medium",
+        num_questions: int = 5,
+        include_assessments: bool = True
+    ) -> Dict[str, Any]:
+        """Queue generation of every piece of a course outline"""
+        data = {
+            "type": "course_pipeline",
+            "user_id": user_id,
+            "topic": topic,
+            "difficulty": difficulty,
+            "num_questions": num_questions,
+            "include_assessments": include_assessments,
+            "course": course
+        }
+        total = len(self._plan(data))
+        
+        # The total is stored with the task so it shows while the task is still queued
+        task_id = await queue_service.enqueue(self.queue_name, data, fields={"progress_total": total})
+        
+        return {"task_id": task_id, "total_pieces": total}
+    
+    def _plan(self, data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """One piece per lesson, and one per assessment day when requested"""
+        lessons = data["course"].get("daily_lessons", [])
+        pieces = [
+            {
+                "key": f"lesson:{lesson['day']}",
+                "kind": "lesson",
+                "day": lesson["day"],
+                "title": lesson.get("title", f"Day {lesson['day']}"),
+                "objectives": lesson.get("objectives", [])
+            }
+            for lesson in lessons
+        ]
+        
+        if data["include_assessments"]:
+            for day in data["course"].get("assessment_days", []):
+                covered_topics = [
+                    topic
+                    for lesson in lessons if lesson["day"] <= day
+                    for topic in lesson.get("topics", [])
+                ]
+                if covered_topics:
+                    pieces.append({
+                        "key": f"assessment:{day}",
+                        "kind": "assessment",
+                        "day": day,
+                        "covered_topics": covered_topics
+                    })
+        
+        return pieces
+    
+    async def process(self, data: Dict[str, Any], task_id: str) -> Dict[str, Any]:
+        if data.get("type") != "course_pipeline":
+            raise ValueError(f"Unknown AI generation task: {data.get('type')}")
+        
+        task = await queue_service.get_task_status(task_id) or {}
+        finished = task.get("pieces", {})
+        pieces = [piece for piece in self._plan(data) if piece["key"] not in finished]
+        
+        # Failures are counted afresh on every attempt
+        await queue_service.update_task_progress(task_id, fields={"progress_failed": 0})
+        semaphore = asyncio.Semaphore(self.max_parallel)
+        
+        async def run(piece: Dict[str, Any]) -> Optional[str]:
+            async with semaphore:
+                try:
+                    content_id = await self._generate(data, piece)
+                except Exception as e:
+                    print(f"Course pipeline {task_id} failed on {piece['key']}: {e}")
+                    await queue_service.update_task_progress(task_id, increments={"failed": 1})
+                    return f"{piece['key']}: {e}"
+                
+                await queue_service.update_task_progress(
+                    task_id,
+                    increments={"done": 1},
+                    fields={f"piece:{piece['key']}": content_id}
+                )
+                return None
+        
+        errors = [error for error in await asyncio.gather(*(run(piece) for piece in pieces)) if error]
+        if errors:
+            # The queue retries the task; pieces saved so far are skipped
+            raise Exception(f"{len(errors)} of {len(pieces)} pieces failed: {'; '.join(errors[:5])}")
+        
+        task = await queue_service.get_task_status(task_id) or {}
+        return {"content_ids": task.get("pieces", {})}
+    
+    async def _generate(self, data: Dict[str, Any], piece: Dict[str, Any]) -> int:
+        """Generate one lesson or assessment and save it, returning its AIContent id"""
+        topic = data["topic"]
+        
+        if piece["kind"] == "lesson":
+            content = await ai_service.generate_day_content(
+                topic=topic,
+                day_number=piece["day"],
+                lesson_title=piece["title"],
+                objectives=piece["objectives"],
+                max_wait=settings.GROQ_QUEUED_MAX_WAIT_SECONDS
+            )
+            ai_content = AIContent(
+                user_id=data["user_id"],
+                topic=f"{topic} - Day {piece['day']}",
+                content_type="lesson",
+                content=content,
+                content_metadata={
+                    "day_number": piece["day"],
+                    "lesson_title": piece["title"],
+                    "objectives": piece["objectives"]
+                }
+            )
+        else:
+            questions = await ai_service.generate_assessment(
+                topic=topic,
+                day_number=piece["day"],
+                covered_topics=piece["covered_topics"],
+                num_questions=data["num_questions"],
+                difficulty=data["difficulty"],
+                max_wait=settings.GROQ_QUEUED_MAX_WAIT_SECONDS
+            )
+            ai_content = AIContent(
+                user_id=data["user_id"],
+                topic=f"{topic} - Day {piece['day']} Assessment",
+                content_type="assessment",
+                content=json.dumps(questions),
+                content_metadata={
+                    "day_number": piece["day"],
+                    "covered_topics": piece["covered_topics"],
+                    "total_marks": sum(q.get("marks", 0) for q in questions)
+                }
+            )
+        
+        async with async_session_maker() as db:
+            db.add(ai_content)
+            await db.commit()
+        
+        return ai_content.id
+
+course_pipeline = CoursePipeline()
@@ -0,0 +1,111 @@
+"""
+Frame Relay
+Latest-frame-wins forwarding of student video frames to viewers. Each
+(viewer, student) stream holds at most one pending frame, is sent at most
+max_fps times a second and waits for the previous frame to be acknowledged
+(or for ack_timeout), so a slow viewer only ever has one frame per student
+in flight and one buffered here
+"""
+import asyncio
+from typing import Dict, Any, List, Set, Tuple
+
+StreamKey = Tuple[str, str]  # (viewer target, student sid)
+
+class FrameRelay:
+    def __init__(self, sio, max_fps: float = 5, ack_timeout: float = 2.0):
+        self.sio = sio
+        self.min_interval = 1 / max_fps if max_fps > 0 else 0
+        self.ack_timeout = ack_timeout
+        
+        self._latest: Dict[StreamKey, Dict[str, Any]] = {}
+        self._active: Set[StreamKey] = set()
+        self._last_sent: Dict[StreamKey, float] = {}
+        self._keys_by_sid: Dict[str, Set[StreamKey]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        
+        # Metrics
+        self.frames_received = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.ack_timeouts = 0
+        self.dropped_by_student: Dict[str, int] = {}
+    
+    def push(self, student_sid: str, targets: List[str], payload: Dict[str, Any]):
+        """Offer a frame to every viewer sid in targets"""
+        self.frames_received += 1
+        
+        for target in targets:
+            key = (target, student_sid)
+            
+            if key in self._latest:
+                # The viewer has not taken the previous frame yet - replace it
+                self.frames_dropped += 1
+                self.dropped_by_student[student_sid] = self.dropped_by_student.get(student_sid, 0) + 1
+            else:
+                self._keys_by_sid.setdefault(target, set()).add(key)
+                self._keys_by_sid.setdefault(student_sid, set()).add(key)
+            
+            self._latest[key] = payload
+            
+            if key not in self._active:
+                self._active.add(key)
+                task = asyncio.create_task(self._pump(key))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+    
+    def forget(self, sid: str):
+        """Drop every stream a disconnected viewer or student took part in"""
+        for key in self._keys_by_sid.pop(sid, ()):
+            self._latest.pop(key, None)
+            self._last_sent.pop(key, None)
+            for other in key:
+                if other != sid and other in self._keys_by_sid:
+                    self._keys_by_sid[other].discard(key)
+                    if not self._keys_by_sid[other]:
+                        del self._keys_by_sid[other]
+        
+        self.dropped_by_student.pop(sid, None)
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            "tracked_sids": len(self._keys_by_sid),
+            "pending_frames": len(self._latest),
+            "frames_received": self.frames_received,
+            "frames_sent": self.frames_sent,
+            "frames_dropped": self.frames_dropped,
+            "ack_timeouts": self.ack_timeouts,
+            "max_fps": round(1 / self.min_interval, 2) if self.min_interval else None
+        }
+    
+    async def _pump(self, key: StreamKey):
+        """Send the newest frame of one stream until nothing is pending"""
+        loop = asyncio.get_running_loop()
+        target, student_sid = key
+        
+        try:
+            while True:
+                delay = self._last_sent.get(key, 0) + self.min_interval - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                
+                payload = self._latest.pop(key, None)
+                if payload is None:
+                    return
+                
+                self._last_sent[key] = loop.time()
+                self.frames_sent += 1
+                payload = {**payload, 'dropped_frames': self.dropped_by_student.get(student_sid, 0)}
+                delivered = loop.create_future()
+                
+                def on_ack(*args):
+                    if not delivered.done():
+                        delivered.set_result(True)
+                
+                await self.sio.emit('student_video_frame', payload, to=target, callback=on_ack)
+                
+                try:
+                    await asyncio.wait_for(delivered, self.ack_timeout)
+                except asyncio.TimeoutError:
+                    self.ack_timeouts += 1
+        finally:
+            self._active.discard(key)
@@ -0,0 +1,284 @@
+"""
+Mosaic Service
+Composites the latest frame of every student in a test into one JPEG grid
+for teachers in mosaic mode. Teacher bandwidth and browser decode cost are
+then bounded by the grid rate instead of the class size; full-resolution
+frames are only relayed for the students a teacher focuses on
+"""
+import asyncio
+import base64
+import json
+import math
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+import cv2
+import numpy as np
+
+from app.services.queue_service import queue_service
+
+def _decode_tile(frame, tile_width: int, tile_height: int) -> Optional[np.ndarray]:
+    """
+    Decode a base64 or binary frame straight to a tile-sized BGR image.
+    A frame that cannot be decoded gives None, drawn as a blank tile.
+    """
+    try:
+        if isinstance(frame, str):
+            frame = base64.b64decode(frame.split(',', 1)[1] if ',' in frame else frame)
+        
+        # Webcam frames are far larger than a tile, so let libjpeg downscale
+        image = cv2.imdecode(np.frombuffer(frame, np.uint8), cv2.IMREAD_REDUCED_COLOR_2)
+        if image is None:
+            return None
+        
+        return cv2.resize(image, (tile_width, tile_height), interpolation=cv2.INTER_AREA)
+    except Exception:
+        return None
+
+def _encode_grid(tiles: List[Optional[np.ndarray]], columns: int, tile_width: int, tile_height: int, quality: int) -> bytes:
+    rows = math.ceil(len(tiles) / columns)
+    canvas = np.zeros((rows * tile_height, columns * tile_width, 3), np.uint8)
+    
+    for index, tile in enumerate(tiles):
+        if tile is None:
+            continue
+        row, column = divmod(index, columns)
+        canvas[
+            row * tile_height:(row + 1) * tile_height,
+            column * tile_width:(column + 1) * tile_width
+        ] = tile
+    
+    _, jpeg = cv2.imencode('.jpg', canvas, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return jpeg.tobytes()
+
+class MosaicService:
+    def __init__(
+        self,
+        sio,
+        fps: float = 1,
+        tile_width: int = 160,
+        tile_height: int = 120,
+        quality: int = 70,
+        workers: int = 2,
+        clustered: bool = False
+    ):
+        self.sio = sio
+        self.interval = 1 / fps if fps > 0 else 1
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.quality = quality
+        self.workers = workers
+        self.clustered = clustered
+        
+        # Frames older than this are left out of the grid
+        self.STALE_SECONDS = 10
+        self.VIEW_PREFIX = "streaming:view"
+        self.VIEW_TTL_SECONDS = 12 * 3600
+        # Tags the grid so a clustered teacher can tell each worker's part apart
+        self.part_id = uuid.uuid4().hex[:8]
+        
+        # test_code -> student sid -> latest frame and who sent it
+        self.frames: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        # test_code -> teacher sid -> {'mode': 'mosaic' | 'individual', 'focus': set of student sids}
+        self.views: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.viewer_tests: Dict[str, str] = {}
+        
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self._task: Optional[asyncio.Task] = None
+        
+        # Metrics
+        self.grids_sent = 0
+        self.last_grid_bytes = 0
+        self.last_compose_ms = 0.0
+    
+    async def start(self):
+        if self._task:
+            return
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="mosaic")
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        
+        if self.executor:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+    
+    async def set_view(self, test_code: str, teacher_sid: str, mode: str, focus: List[str]):
+        """Switch a teacher between the full per-student feeds and the mosaic"""
+        view = {'mode': mode, 'focus': set(focus or [])}
+        self.views.setdefault(test_code, {})[teacher_sid] = view
+        self.viewer_tests[teacher_sid] = test_code
+        
+        if self.clustered:
+            await queue_service.connect()
+            key = self._view_key(test_code)
+            async with queue_service.redis_client.pipeline(transaction=True) as pipe:
+                pipe.hset(key, teacher_sid, json.dumps({'mode': mode, 'focus': list(view['focus'])}))
+                pipe.expire(key, self.VIEW_TTL_SECONDS)
+                await pipe.execute()
+    
+    async def remove_viewer(self, teacher_sid: str):
+        test_code = self.viewer_tests.pop(teacher_sid, None)
+        if test_code is None:
+            return
+        
+        views = self.views.get(test_code, {})
+        views.pop(teacher_sid, None)
+        if not views:
+            self.views.pop(test_code, None)
+            self.frames.pop(test_code, None)
+        
+        if self.clustered:
+            await queue_service.connect()
+            await queue_service.redis_client.hdel(self._view_key(test_code), teacher_sid)
+    
+    def remove_student(self, test_code: Optional[str], student_sid: str):
+        frames = self.frames.get(test_code)
+        if frames is not None:
+            frames.pop(student_sid, None)
+    
+    def offer(self, test_code: str, student_sid: str, student_id: Any, student_name: str, frame: Any):
+        """Keep the newest frame of a student for the next grid"""
+        if frame is None:
+            return
+        # Locally we know whether anyone watches the mosaic; clustered viewers
+        # may sit on another worker, so their views are refreshed by the loop
+        if not self.clustered and not self._has_mosaic_viewer(test_code):
+            return
+        
+        self.frames.setdefault(test_code, {})[student_sid] = {
+            'frame': frame,
+            'student_id': student_id,
+            'student_name': student_name,
+            'received_at': time.monotonic()
+        }
+    
+    def wants_full_frame(self, test_code: str, student_sid: str, teacher_sid: Optional[str] = None) -> bool:
+        """
+        Whether full-resolution frames of a student should still be relayed,
+        to one teacher or (teacher_sid=None) to anyone watching the test
+        """
+        views = self.views.get(test_code)
+        if not views:
+            return True
+        
+        if teacher_sid is not None:
+            view = views.get(teacher_sid)
+            return view is None or view['mode'] != 'mosaic' or student_sid in view['focus']
+        
+        return any(
+            view['mode'] != 'mosaic' or student_sid in view['focus']
+            for view in views.values()
+        )
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            "mosaic_tests": sum(1 for test_code in self.views if self._has_mosaic_viewer(test_code)),
+            "buffered_frames": sum(len(frames) for frames in self.frames.values()),
+            "grids_sent": self.grids_sent,
+            "last_grid_bytes": self.last_grid_bytes,
+            "last_compose_ms": round(self.last_compose_ms, 2)
+        }
+    
+    def _view_key(self, test_code: str) -> str:
+        return f"{self.VIEW_PREFIX}:{test_code}"
+    
+    def _has_mosaic_viewer(self, test_code: str) -> bool:
+        return any(view['mode'] == 'mosaic' for view in self.views.get(test_code, {}).values())
+    
+    async def _refresh_views(self):
+        """Pull every teacher's view for the tests this worker holds frames of"""
+        test_codes = list(self.frames)
+        if not test_codes:
+            return
+        
+        await queue_service.connect()
+        async with queue_service.redis_client.pipeline(transaction=False) as pipe:
+            for test_code in test_codes:
+                pipe.hgetall(self._view_key(test_code))
+            results = await pipe.execute()
+        
+        for test_code, raw_views in zip(test_codes, results):
+            views = {}
+            for teacher_sid, raw in raw_views.items():
+                view = json.loads(raw)
+                views[teacher_sid] = {'mode': view['mode'], 'focus': set(view['focus'])}
+            if views:
+                self.views[test_code] = views
+            else:
+                self.views.pop(test_code, None)
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            started = loop.time()
+            try:
+                if self.clustered:
+                    await self._refresh_views()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Mosaic view refresh error: {e}")
+            
+            # One test's failure must not stop the grids of the others
+            for test_code in list(self.frames):
+                try:
+                    if self._has_mosaic_viewer(test_code):
+                        await self._send_grid(test_code)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"Mosaic error for {test_code}: {e}")
+            
+            await asyncio.sleep(max(0, self.interval - (loop.time() - started)))
+    
+    async def _send_grid(self, test_code: str):
+        now = time.monotonic()
+        frames = self.frames.get(test_code, {})
+        
+        for student_sid in [sid for sid, entry in frames.items() if now - entry['received_at'] > self.STALE_SECONDS]:
+            del frames[student_sid]
+        
+        if not frames:
+            return
+        
+        entries = sorted(frames.items(), key=lambda item: str(item[1]['student_name']))
+        columns = max(1, math.ceil(math.sqrt(len(entries))))
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        
+        # Tiles are decoded in parallel across the pool, then stitched once
+        tiles = await asyncio.gather(*(
+            loop.run_in_executor(self.executor, _decode_tile, entry['frame'], self.tile_width, self.tile_height)
+            for _, entry in entries
+        ))
+        jpeg = await loop.run_in_executor(
+            self.executor, _encode_grid, tiles, columns, self.tile_width, self.tile_height, self.quality
+        )
+        
+        self.last_compose_ms = (time.perf_counter() - started) * 1000
+        self.last_grid_bytes = len(jpeg)
+        self.grids_sent += 1
+        
+        await self.sio.emit('student_mosaic', {
+            'test_code': test_code,
+            'part': self.part_id,
+            'image': jpeg,
+            'columns': columns,
+            'tile_width': self.tile_width,
+            'tile_height': self.tile_height,
+            'tiles': [
+                {'sid': student_sid, 'student_id': entry['student_id'], 'student_name': entry['student_name']}
+                for student_sid, entry in entries
+            ],
+            'timestamp': time.time()
+        }, room=f"test_{test_code}_mosaic")
@@ -0,0 +1,232 @@
+"""
+Proctoring Log Writer
+Buffers ProctoringLog rows in-process and writes them with one multi-row
+INSERT every N rows or M milliseconds instead of one ORM flush per request.
+While the database is unreachable a batch is kept and retried with growing
+backoff; a batch rejected for its data is split so one bad row cannot sink
+the rest, and that row is dead-lettered to a file rather than dropped
+"""
+import asyncio
+import json
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from sqlalchemy import insert, update
+from sqlalchemy.exc import DataError, IntegrityError, InterfaceError, OperationalError
+
+from app.core.config import settings
+from app.core.database import async_session_maker
+from app.models import ProctoringLog, TestAttempt
+
+# Rejected for what is in a row: retrying the same rows cannot help
+DATA_ERRORS = (IntegrityError, DataError)
+# The database is down or unreachable: every row would fail the same way
+OUTAGE_ERRORS = (OperationalError, InterfaceError, OSError, asyncio.TimeoutError)
+
+class ProctoringLogWriter:
+    def __init__(self, batch_size: int = 500, flush_interval_ms: int = 250, max_queue: int = 50000):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_queue = max_queue
+        
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        
+        # Outages are waited out; other errors, or any during shutdown, get this many retries
+        self.MAX_RETRIES = 3
+        self.MAX_RETRY_BACKOFF_SECONDS = 30
+        self.dead_letter_path = settings.PROCTORING_LOGS_DIR / "failed_log_rows.jsonl"
+        
+        # Metrics
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.retries = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+    
+    async def start(self):
+        if self._task:
+            return
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop the background writer and flush everything still queued"""
+        self._stopping = True
+        if self._task:
+            # The sentinel lets the writer finish the batch it is collecting
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+        
+        while self._queue and not self._queue.empty():
+            batch = []
+            while not self._queue.empty() and len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+            await self._flush(batch)
+    
+    async def write(
+        self,
+        attempt_id: int,
+        student_id: int,
+        violation_type: str,
+        severity: str,
+        description: Optional[str] = None,
+        log_metadata: Optional[Dict[str, Any]] = None,
+        timestamp: Optional[datetime] = None,
+        count_violation: bool = True
+    ):
+        """Queue one log row; count_violation also bumps attempt.proctoring_violations"""
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+        
+        row = {
+            "attempt_id": attempt_id,
+            "student_id": student_id,
+            "violation_type": violation_type,
+            "severity": severity,
+            "description": description,
+            "log_metadata": log_metadata,
+            "timestamp": timestamp or datetime.utcnow(),
+        }
+        # Blocks only when the buffer is full, pushing back on producers
+        await self._queue.put((row, count_violation))
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "queue_capacity": self.max_queue,
+            "rows_written": self.rows_written,
+            "rows_failed": self.rows_failed,
+            "retries": self.retries,
+            "flushes": self.flushes,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 2) if self.flushes else 0.0,
+            "running": self._task is not None and not self._task.done()
+        }
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            
+            batch = [item]
+            stopping = False
+            deadline = loop.time() + self.flush_interval
+            
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    await asyncio.sleep(min(remaining, 0.01))
+                    continue
+                
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            
+            await self._flush(batch)
+            
+            if stopping:
+                return
+    
+    async def _flush(self, batch: List[Tuple[Dict[str, Any], bool]]):
+        if not batch:
+            return
+        
+        started = time.perf_counter()
+        try:
+            await self._write_batch(batch)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.flushes += 1
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.total_flush_ms += elapsed_ms
+
+    async def _write(self, batch: List[Tuple[Dict[str, Any], bool]]):
+        rows = [row for row, _ in batch]
+        violations_per_attempt: Dict[int, int] = {}
+        for row, count_violation in batch:
+            if count_violation:
+                violations_per_attempt[row["attempt_id"]] = violations_per_attempt.get(row["attempt_id"], 0) + 1
+        
+        async with async_session_maker() as db:
+            # A list of parameter sets is sent as a single multi-row INSERT
+            await db.execute(insert(ProctoringLog), rows)
+            
+            for attempt_id, count in violations_per_attempt.items():
+                await db.execute(
+                    update(TestAttempt)
+                    .where(TestAttempt.id == attempt_id)
+                    .values(proctoring_violations=TestAttempt.proctoring_violations + count)
+                )
+            
+            await db.commit()
+        
+        self.rows_written += len(rows)
+    
+    async def _write_batch(self, batch: List[Tuple[Dict[str, Any], bool]]):
+        """
+        Write a batch, keeping it through a database outage and splitting it
+        only when the database rejects its data
+        """
+        attempt = 0
+        while True:
+            try:
+                await self._write(batch)
+                return
+            except DATA_ERRORS as e:
+                if len(batch) == 1:
+                    self._dead_letter(batch)
+                    return
+                
+                # Isolate the bad row by halving; each half gets the same handling
+                print(f"Proctoring log batch rejected ({len(batch)} rows), splitting: {e}")
+                middle = len(batch) // 2
+                for half in (batch[:middle], batch[middle:]):
+                    await self._write_batch(half)
+                return
+            except Exception as e:
+                outage = isinstance(e, OUTAGE_ERRORS)
+                if attempt >= self.MAX_RETRIES and (self._stopping or not outage):
+                    print(f"Proctoring log flush gave up ({len(batch)} rows): {e}")
+                    self._dead_letter(batch)
+                    return
+                
+                backoff = min(self.MAX_RETRY_BACKOFF_SECONDS, 0.5 * 2 ** attempt)
+                print(f"Proctoring log flush failed ({len(batch)} rows, attempt {attempt + 1}), retrying in {backoff}s: {e}")
+                attempt += 1
+                self.retries += 1
+                await asyncio.sleep(backoff)
+    
+    def _dead_letter(self, batch: List[Tuple[Dict[str, Any], bool]]):
+        """Keep rows that could not be written so they can be replayed by hand"""
+        self.rows_failed += len(batch)
+        try:
+            self.dead_letter_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                for row, count_violation in batch:
+                    f.write(json.dumps({"row": row, "count_violation": count_violation}, default=str) + "\n")
+            print(f"{len(batch)} proctoring log rows dead-lettered to {self.dead_letter_path}")
+        except Exception as e:
+            print(f"{len(batch)} proctoring log rows lost ({e}), first: {batch[0][0]}")
+
+proctoring_log_writer = ProctoringLogWriter(
+    batch_size=settings.PROCTORING_LOG_BATCH_SIZE,
+    flush_interval_ms=settings.PROCTORING_LOG_FLUSH_INTERVAL_MS,
+    max_queue=settings.PROCTORING_LOG_MAX_QUEUE
+)
@@ -1,20 +1,49 @@
+import asyncio
+import math
+import multiprocessing
+import threading
+import time
 import cv2
 import numpy as np
-from typing import Dict, Any, List
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Set, Tuple, Union
 import base64
 from datetime import datetime
 
+from app.core.config import settings
+from app.services.face_detectors import FaceDetector, create_face_detector
+
 class ProctoringService:
-    def __init__(self):
-        self.face_cascade = cv2.CascadeClassifier(
-            cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-        )
-        self.eye_cascade = cv2.CascadeClassifier(
-            cv2.data.haarcascades + 'haarcascade_eye.xml'
-        )
+    def __init__(self, detector: Optional[FaceDetector] = None):
+        self.detector = detector or create_face_detector()
         
         self.MULTIPLE_FACES_THRESHOLD = 1
         self.NO_FACE_DURATION_THRESHOLD = 3
+        # Fraction of the tracked face size searched around it on tracked frames
+        self.TRACK_PADDING = 0.5
+        # Frames are analyzed at most this wide (0 = native resolution)
+        self.ANALYSIS_WIDTH = settings.PROCTORING_ANALYSIS_WIDTH
+        
+        self.tracker = FaceTracker(
+            redetect_every=settings.PROCTORING_TRACK_REDETECT_EVERY,
+            ttl_seconds=settings.PROCTORING_TRACK_TTL_SECONDS
+        )
+        self.batch_engine = FrameBatchEngine(
+            workers=settings.PROCTORING_WORKERS,
+            batch_size=settings.PROCTORING_BATCH_SIZE,
+            batch_window_ms=settings.PROCTORING_BATCH_WINDOW_MS,
+            max_pending=settings.PROCTORING_MAX_PENDING_FRAMES,
+            use_processes=settings.PROCTORING_USE_PROCESSES,
+            tracker=self.tracker
+        )
+    
+    async def start(self):
+        """Start the frame analysis worker pool"""
+        await self.batch_engine.start()
+    
+    async def stop(self):
+        """Stop the frame analysis worker pool"""
+        await self.batch_engine.stop()
     
     def decode_image(self, base64_image: str) -> np.ndarray:
         try:
@@ -29,11 +58,99 @@ class ProctoringService:
             print(f"Error decoding image: {e}")
             return None
     
-    async def analyze_frame(self, frame_base64: str) -> Dict[str, Any]:
+    def decode_gray(self, frame_data: Union[str, bytes, bytearray, memoryview]) -> Tuple[Optional[np.ndarray], float]:
+        """
+        Decode a base64 or raw JPEG/WebP frame straight to grayscale at roughly
+        ANALYSIS_WIDTH, without materialising a full-size colour image.
+        
+        Returns (gray, scale) where scale maps analysis pixels back to source pixels.
+        """
+        try:
+            if isinstance(frame_data, str):
+                if ',' in frame_data:
+                    frame_data = frame_data.split(',')[1]
+                frame_data = base64.b64decode(frame_data)
+            
+            view = memoryview(frame_data)
+            
+            # libjpeg can decode at 1/2 or 1/4 size directly, far cheaper than
+            # a full decode followed by a resize
+            reduction = 1
+            source_width = _jpeg_width(view)
+            if self.ANALYSIS_WIDTH and source_width:
+                if source_width >= self.ANALYSIS_WIDTH * 4:
+                    reduction = 4
+                elif source_width >= self.ANALYSIS_WIDTH * 2:
+                    reduction = 2
+            
+            flag = {
+                1: cv2.IMREAD_GRAYSCALE,
+                2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                4: cv2.IMREAD_REDUCED_GRAYSCALE_4
+            }[reduction]
+            gray = cv2.imdecode(np.frombuffer(view, np.uint8), flag)
+            
+            if gray is None:
+                return None, 1.0
+            
+            scale = float(reduction)
+            if self.ANALYSIS_WIDTH and gray.shape[1] > self.ANALYSIS_WIDTH:
+                factor = self.ANALYSIS_WIDTH / gray.shape[1]
+                gray = cv2.resize(
+                    gray,
+                    (self.ANALYSIS_WIDTH, max(1, round(gray.shape[0] * factor))),
+                    interpolation=cv2.INTER_AREA
+                )
+                scale /= factor
+            
+            return gray, scale
+        except Exception as e:
+            print(f"Error decoding image: {e}")
+            return None, 1.0
+    
+    async def analyze_frame(self, frame: Union[str, bytes], attempt_id: Optional[int] = None) -> Dict[str, Any]:
+        """Analyze a base64 or raw-bytes frame on the worker pool without blocking the event loop"""
+        return await self.batch_engine.submit(attempt_id, frame)
+    
+    async def analyze_frames(self, frames: List[Tuple[int, Union[str, bytes]]]) -> List[Tuple[int, Dict[str, Any]]]:
+        """Analyze frames from many attempts and return (attempt_id, result) pairs"""
+        return await self.batch_engine.submit_many(frames)
+    
+    def detect_faces(self, gray: np.ndarray, track_box: Optional[Tuple[int, int, int, int]] = None):
+        """
+        Detect faces, searching only a padded ROI around track_box when given.
+        
+        Returns (faces, full_detection). Falls back to a full-frame search when
+        the ROI does not contain exactly one face, so a lost track or a second
+        person entering near the student is never hidden by tracking.
+        """
+        if track_box is not None:
+            x, y, w, h = track_box
+            pad_x = int(w * self.TRACK_PADDING)
+            pad_y = int(h * self.TRACK_PADDING)
+            x0 = max(0, x - pad_x)
+            y0 = max(0, y - pad_y)
+            x1 = min(gray.shape[1], x + w + pad_x)
+            y1 = min(gray.shape[0], y + h + pad_y)
+            
+            if x1 > x0 and y1 > y0:
+                roi_faces = self.detector.detect_faces(gray[y0:y1, x0:x1])
+                
+                if len(roi_faces) == 1:
+                    fx, fy, fw, fh = roi_faces[0]
+                    return [(fx + x0, fy + y0, fw, fh)], False
+        
+        return self.detector.detect_faces(gray), True
+    
+    def analyze_frame_sync(
+        self,
+        frame_data: Union[str, bytes, bytearray, memoryview],
+        track_box: Optional[Tuple[int, int, int, int]] = None
+    ) -> Dict[str, Any]:
         violations = []
-        frame = self.decode_image(frame_base64)
+        gray, scale = self.decode_gray(frame_data)
         
-        if frame is None:
+        if gray is None:
             return {
                 "violations": [{
                     "type": "invalid_frame",
@@ -45,16 +162,16 @@ class ProctoringService:
                 "gaze_direction": None
             }
         
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        # Head-pose offsets are measured against the source frame size
+        frame_shape = (round(gray.shape[0] * scale), round(gray.shape[1] * scale))
         
-        faces = self.face_cascade.detectMultiScale(
-            gray,
-            scaleFactor=1.1,
-            minNeighbors=5,
-            minSize=(30, 30)
-        )
+        if track_box is not None:
+            track_box = tuple(int(v / scale) for v in track_box)
+        
+        faces, full_detection = self.detect_faces(gray, track_box)
         
         face_count = len(faces)
+        face_box = None
         
         if face_count == 0:
             violations.append({
@@ -76,12 +193,11 @@ class ProctoringService:
             x, y, w, h = faces[0]
             face_roi_gray = gray[y:y+h, x:x+w]
             
-            eyes = self.eye_cascade.detectMultiScale(
-                face_roi_gray,
-                scaleFactor=1.1,
-                minNeighbors=5,
-                minSize=(20, 20)
-            )
+            # Map the face back to source-frame coordinates
+            x, y, w, h = (int(v * scale) for v in (x, y, w, h))
+            face_box = (x, y, w, h)
+            
+            eyes = self.detector.detect_eyes(face_roi_gray)
             
             if len(eyes) < 2:
                 violations.append({
@@ -93,22 +209,22 @@ class ProctoringService:
             else:
                 gaze_direction = "forward"
             
-            frame_center_x = frame.shape[1] // 2
-            frame_center_y = frame.shape[0] // 2
+            frame_center_x = frame_shape[1] // 2
+            frame_center_y = frame_shape[0] // 2
             face_center_x = x + w // 2
             face_center_y = y + h // 2
             
             horizontal_offset = abs(face_center_x - frame_center_x)
             vertical_offset = abs(face_center_y - frame_center_y)
             
-            if horizontal_offset > frame.shape[1] * 0.25:
+            if horizontal_offset > frame_shape[1] * 0.25:
                 head_pose = "turned_horizontal"
                 violations.append({
                     "type": "head_turned",
                     "severity": "medium",
                     "description": "Head is turned significantly to the side"
                 })
-            elif vertical_offset > frame.shape[0] * 0.2:
+            elif vertical_offset > frame_shape[0] * 0.2:
                 head_pose = "tilted"
                 violations.append({
                     "type": "head_tilted",
@@ -123,7 +239,276 @@ class ProctoringService:
             "face_count": face_count,
             "head_pose": head_pose,
             "gaze_direction": gaze_direction,
-            "timestamp": datetime.utcnow().isoformat()
+            "timestamp": datetime.utcnow().isoformat(),
+            # Consumed by the batch engine to update the attempt's face track
+            "_face_box": face_box,
+            "_full_detection": full_detection
         }
 
+def _jpeg_width(data: memoryview) -> Optional[int]:
+    """Read the image width from a JPEG's SOF header, or None if not a JPEG"""
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        # SOF0-SOF15, excluding DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            return (data[i + 7] << 8) | data[i + 8]
+        i += 2 + ((data[i + 2] << 8) | data[i + 3])
+    
+    return None
+
+class FaceTrack:
+    """Last known face box for one attempt"""
+    __slots__ = ("box", "frames_since_full", "last_seen")
+    
+    def __init__(self):
+        self.box: Optional[Tuple[int, int, int, int]] = None
+        self.frames_since_full = 0
+        self.last_seen = 0.0
+
+class FaceTracker:
+    """
+    Per-attempt face tracks so most frames only run detection on a padded ROI
+    around the previous face. A full-frame detection is forced every
+    redetect_every frames, and tracks idle for ttl_seconds are evicted.
+    """
+    
+    def __init__(self, redetect_every: int = 10, ttl_seconds: float = 60):
+        self.redetect_every = max(1, redetect_every)
+        self.ttl_seconds = ttl_seconds
+        self.tracks: Dict[int, FaceTrack] = {}
+        self._next_sweep = 0.0
+    
+    def hint(self, attempt_id: Optional[int]) -> Optional[Tuple[int, int, int, int]]:
+        """Box to search around for the next frame, or None for a full-frame detection"""
+        now = time.monotonic()
+        self._sweep(now)
+        
+        if attempt_id is None:
+            return None
+        
+        track = self.tracks.get(attempt_id)
+        if (
+            track is None
+            or track.box is None
+            or track.frames_since_full >= self.redetect_every
+            or now - track.last_seen > self.ttl_seconds
+        ):
+            return None
+        
+        return track.box
+    
+    def update(self, attempt_id: Optional[int], box: Optional[Tuple[int, int, int, int]], full_detection: bool):
+        if attempt_id is None:
+            return
+        
+        track = self.tracks.get(attempt_id)
+        if track is None:
+            track = FaceTrack()
+            self.tracks[attempt_id] = track
+        
+        track.box = box
+        track.frames_since_full = 0 if full_detection else track.frames_since_full + 1
+        track.last_seen = time.monotonic()
+    
+    def _sweep(self, now: float):
+        if now < self._next_sweep:
+            return
+        
+        self._next_sweep = now + self.ttl_seconds / 2
+        expired = [
+            attempt_id for attempt_id, track in self.tracks.items()
+            if now - track.last_seen > self.ttl_seconds
+        ]
+        for attempt_id in expired:
+            del self.tracks[attempt_id]
+
+# Each pool worker (process or thread) owns its own detector, since
+# CascadeClassifier and dnn.Net instances must not be shared between threads.
+_worker_state = threading.local()
+
+def _get_worker_service() -> ProctoringService:
+    service = getattr(_worker_state, "service", None)
+    if service is None:
+        service = ProctoringService()
+        _worker_state.service = service
+    return service
+
+def _init_worker():
+    """Load the detector once when a worker starts"""
+    _get_worker_service()
+
+def _analyze_batch(frames: List[Tuple[Union[str, bytes], Optional[Tuple[int, int, int, int]]]]) -> List[Dict[str, Any]]:
+    """Runs inside a pool worker: analyze a chunk of (frame, track_box) pairs sequentially"""
+    service = _get_worker_service()
+    return [service.analyze_frame_sync(frame, track_box) for frame, track_box in frames]
+
+class FrameBatchEngine:
+    """
+    Collects frames from many attempts and analyzes them in batches on a
+    worker pool, so CPU-bound face detection never runs on the event loop.
+
+    Frames are gathered for up to batch_window_ms (or until batch_size frames
+    are waiting), split across the workers and decoded/classified there.
+    """
+    
+    def __init__(
+        self,
+        workers: int = 2,
+        batch_size: int = 16,
+        batch_window_ms: int = 20,
+        max_pending: int = 1000,
+        use_processes: bool = True,
+        tracker: Optional[FaceTracker] = None
+    ):
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.batch_window = batch_window_ms / 1000
+        self.max_pending = max_pending
+        self.use_processes = use_processes
+        self.tracker = tracker
+        
+        self._executor: Optional[Executor] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._collector: Optional[asyncio.Task] = None
+        self._inflight: Set[asyncio.Task] = set()
+    
+    @property
+    def running(self) -> bool:
+        return self._collector is not None and not self._collector.done()
+    
+    async def start(self):
+        if self.running:
+            return
+        
+        if self.use_processes:
+            # spawn keeps workers independent of the server's threads and
+            # behaves the same on Windows and Linux
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker
+            )
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="proctoring",
+                initializer=_init_worker
+            )
+        
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        # Two chunks per worker keeps every core busy while the next
+        # batch is being collected, without unbounded executor backlog
+        self._slots = asyncio.Semaphore(self.workers * 2)
+        self._collector = asyncio.create_task(self._collect())
+    
+    async def stop(self):
+        if self._collector:
+            self._collector.cancel()
+            try:
+                await self._collector
+            except asyncio.CancelledError:
+                pass
+            self._collector = None
+        
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        
+        if self._queue:
+            while not self._queue.empty():
+                _, _, future = self._queue.get_nowait()
+                if not future.done():
+                    future.set_exception(RuntimeError("Frame analysis engine stopped"))
+        
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+    
+    async def submit(self, attempt_id: Optional[int], frame: Union[str, bytes]) -> Dict[str, Any]:
+        """Queue one frame and wait for its analysis"""
+        if not self.running:
+            await self.start()
+        
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((attempt_id, frame, future))
+        return await future
+    
+    async def submit_many(self, frames: List[Tuple[int, Union[str, bytes]]]) -> List[Tuple[int, Dict[str, Any]]]:
+        """Queue frames from many attempts and return results in input order"""
+        results = await asyncio.gather(
+            *(self.submit(attempt_id, frame) for attempt_id, frame in frames)
+        )
+        return [(attempt_id, result) for (attempt_id, _), result in zip(frames, results)]
+    
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_window
+            # Frames before this index have been handed to a chunk task
+            dispatched = 0
+            
+            try:
+                # Poll rather than wait_for(queue.get()), which can drop an
+                # item when the timeout fires as it arrives
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                        continue
+                    except asyncio.QueueEmpty:
+                        pass
+                    
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    await asyncio.sleep(min(remaining, 0.005))
+                
+                # Spread the batch over the workers so each core gets a share
+                chunk_size = max(1, math.ceil(len(batch) / self.workers))
+                for i in range(0, len(batch), chunk_size):
+                    await self._slots.acquire()
+                    task = asyncio.create_task(self._run_chunk(batch[i:i + chunk_size]))
+                    self._inflight.add(task)
+                    task.add_done_callback(self._inflight.discard)
+                    dispatched = i + chunk_size
+            except asyncio.CancelledError:
+                # Stopped while collecting or waiting for a slot: frames not
+                # yet dispatched are in neither the queue nor a chunk task
+                for _, _, future in batch[dispatched:]:
+                    if not future.done():
+                        future.set_exception(RuntimeError("Frame analysis engine stopped"))
+                raise
+    
+    async def _run_chunk(self, chunk: List[Tuple[Optional[int], Union[str, bytes], asyncio.Future]]):
+        try:
+            frames = [
+                (frame, self.tracker.hint(attempt_id) if self.tracker else None)
+                for attempt_id, frame, _ in chunk
+            ]
+            results = await asyncio.get_running_loop().run_in_executor(
+                self._executor, _analyze_batch, frames
+            )
+            for (attempt_id, _, future), result in zip(chunk, results):
+                if "_face_box" in result:
+                    face_box = result.pop("_face_box")
+                    full_detection = result.pop("_full_detection")
+                    if self.tracker:
+                        self.tracker.update(attempt_id, face_box, full_detection)
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            print(f"Frame batch analysis error: {e}")
+            for _, _, future in chunk:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._slots.release()
+
 proctoring_service = ProctoringService()
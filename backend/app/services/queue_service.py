@@ -4,11 +4,49 @@ Uses Redis for task queuing to prevent resource exhaustion
 """
 import asyncio
 import json
-from typing import Dict, Any, Optional
+import time
+import uuid
+from typing import Dict, Any, List, Optional
 from datetime import datetime
 import redis.asyncio as redis
 from app.core.config import settings
 
+# Queues and processing sets hold task ids only; each task's payload and
+# status live once, in the hash task:<id>.
+#
+# Atomically re-queue tasks whose lease expired, then move the highest
+# priority task into the processing set with a fresh lease and return its
+# hash. Ids whose hash already expired are discarded.
+# KEYS[1] queue, KEYS[2] processing set
+# ARGV[1] now, ARGV[2] lease deadline, ARGV[3] max expired leases to re-queue,
+# ARGV[4] task hash key prefix
+CLAIM_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[3]))
+for _, task_id in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], task_id)
+    local key = ARGV[4] .. task_id
+    if redis.call('EXISTS', key) == 1 then
+        local priority = redis.call('HGET', key, 'priority') or 0
+        redis.call('ZADD', KEYS[1], priority, task_id)
+        redis.call('HSET', key, 'status', 'queued')
+    end
+end
+
+while true do
+    local popped = redis.call('ZPOPMAX', KEYS[1])
+    if #popped == 0 then
+        return false
+    end
+
+    local key = ARGV[4] .. popped[1]
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('ZADD', KEYS[2], ARGV[2], popped[1])
+        redis.call('HSET', key, 'status', 'processing')
+        return redis.call('HGETALL', key)
+    end
+end
+"""
+
 class QueueService:
     def __init__(self):
         self.redis_client: Optional[redis.Redis] = None
@@ -25,6 +63,19 @@ class QueueService:
         self.MAX_CONCURRENT_TEST_TASKS = 10
         self.MAX_CONCURRENT_PROCTORING = 50
         
+        # Leases: a claimed task returns to its queue if the worker stops
+        # renewing it (crash, lost connection) for LEASE_SECONDS
+        self.LEASE_SECONDS = 300
+        self.REQUEUE_BATCH = 100
+        # How long an idle worker blocks waiting for a wake-up before it
+        # looks for expired leases again
+        self.IDLE_WAIT_SECONDS = 5
+        self.NOTIFY_MAX = 1000
+        self.TASK_TTL_SECONDS = 3600
+        self.MAX_RETRIES = 3
+        
+        self._claim_script = None
+        
     async def connect(self):
         """Connect to Redis"""
         if not self.redis_client:
@@ -33,13 +84,20 @@ class QueueService:
                 encoding="utf-8",
                 decode_responses=True
             )
+            self._claim_script = self.redis_client.register_script(CLAIM_SCRIPT)
     
     async def disconnect(self):
         """Disconnect from Redis"""
         if self.redis_client:
             await self.redis_client.close()
     
-    async def enqueue(self, queue_name: str, task_data: Dict[str, Any], priority: int = 0) -> str:
+    async def enqueue(
+        self,
+        queue_name: str,
+        task_data: Dict[str, Any],
+        priority: int = 0,
+        fields: Optional[Dict[str, Any]] = None
+    ) -> str:
         """
         Add a task to the queue
         
@@ -47,40 +105,117 @@ class QueueService:
             queue_name: Name of the queue
             task_data: Task data to enqueue
             priority: Task priority (higher = more important)
+            fields: Extra fields stored on the task, e.g. progress_total
         
         Returns:
             task_id: Unique task identifier
         """
+        task_ids = await self.enqueue_many(queue_name, [task_data], priority, fields)
+        return task_ids[0]
+    
+    async def enqueue_many(
+        self,
+        queue_name: str,
+        tasks_data: List[Dict[str, Any]],
+        priority: int = 0,
+        fields: Optional[Dict[str, Any]] = None
+    ) -> List[str]:
+        """
+        Add several tasks to the queue in a single MULTI/EXEC round trip
+        
+        Args:
+            queue_name: Name of the queue
+            tasks_data: Task data for each task to enqueue
+            priority: Priority given to every task (higher = more important)
+            fields: Extra fields stored on every task, readable from the moment it is queued
+        
+        Returns:
+            task_ids: Unique task identifiers, in the order of tasks_data
+        """
         await self.connect()
         
-        task_id = f"{queue_name}:{datetime.utcnow().timestamp()}"
-        task = {
-            "id": task_id,
-            "data": task_data,
-            "priority": priority,
-            "status": "queued",
-            "created_at": datetime.utcnow().isoformat(),
-            "attempts": 0
-        }
+        if not tasks_data:
+            return []
         
-        # Add to Redis sorted set (sorted by priority)
-        await self.redis_client.zadd(
-            queue_name,
-            {json.dumps(task): priority}
-        )
+        created_at = datetime.utcnow().isoformat()
+        task_ids = []
         
-        # Store task metadata
-        await self.redis_client.setex(
-            f"task:{task_id}",
-            3600,  # Expire in 1 hour
-            json.dumps(task)
-        )
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            for task_data in tasks_data:
+                # uuid4 ids cannot collide the way timestamps do under bursts
+                task_id = f"{queue_name}:{uuid.uuid4().hex}"
+                task_ids.append(task_id)
+                
+                pipe.hset(self._task_key(task_id), mapping={
+                    **(fields or {}),
+                    "id": task_id,
+                    "data": json.dumps(task_data),
+                    "priority": priority,
+                    "status": "queued",
+                    "created_at": created_at,
+                    "attempts": 0
+                })
+                pipe.expire(self._task_key(task_id), self.TASK_TTL_SECONDS)
+            
+            # The sorted set holds ids only, ranked by priority
+            pipe.zadd(queue_name, {task_id: priority for task_id in task_ids})
+            pipe.lpush(self._notify_key(queue_name), *([1] * min(len(task_ids), self.NOTIFY_MAX)))
+            pipe.ltrim(self._notify_key(queue_name), 0, self.NOTIFY_MAX - 1)
+            await pipe.execute()
         
-        return task_id
+        return task_ids
+    
+    def _task_key(self, task_id: str) -> str:
+        return f"task:{task_id}"
+    
+    def _processing_key(self, queue_name: str) -> str:
+        return f"{queue_name}:processing"
+    
+    def _notify_key(self, queue_name: str) -> str:
+        return f"{queue_name}:notify"
+    
+    def _decode_task(self, raw: Dict[str, str]) -> Dict[str, Any]:
+        """Turn a task hash back into the task dict callers expect"""
+        task = dict(raw)
+        task["data"] = json.loads(task["data"]) if "data" in task else None
+        task["priority"] = int(float(task.get("priority", 0)))
+        task["attempts"] = int(task.get("attempts", 0))
+        if "result" in task:
+            task["result"] = json.loads(task["result"])
+        
+        # Progress counters and finished pieces written by update_task_progress
+        pieces = {}
+        for field in list(task):
+            if field.startswith("progress_"):
+                task[field] = int(task[field])
+            elif field.startswith("piece:"):
+                pieces[field[len("piece:"):]] = task.pop(field)
+        if pieces:
+            task["pieces"] = pieces
+        return task
+    
+    async def _notify(self, queue_name: str):
+        """Wake one worker blocked on this queue"""
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.lpush(self._notify_key(queue_name), 1)
+            pipe.ltrim(self._notify_key(queue_name), 0, self.NOTIFY_MAX - 1)
+            await pipe.execute()
+    
+    async def wait_for_task(self, queue_name: str, timeout: Optional[float] = None):
+        """Block until a task is enqueued or finished on this queue, or timeout"""
+        await self.connect()
+        await self.redis_client.blpop(
+            self._notify_key(queue_name),
+            timeout=timeout if timeout is not None else self.IDLE_WAIT_SECONDS
+        )
     
     async def dequeue(self, queue_name: str) -> Optional[Dict[str, Any]]:
         """
-        Get the highest priority task from queue
+        Claim the highest priority task from queue
+        
+        The task is moved into the queue's processing set under a lease in
+        one atomic step, so two workers can never claim the same task. Call
+        ack() when done and extend_lease() while a long task runs.
         
         Args:
             queue_name: Name of the queue
@@ -90,58 +225,104 @@ class QueueService:
         """
         await self.connect()
         
-        # Get highest priority item (ZREVRANGE for descending order)
-        result = await self.redis_client.zrevrange(queue_name, 0, 0)
+        now = time.time()
+        raw = await self._claim_script(
+            keys=[queue_name, self._processing_key(queue_name)],
+            args=[now, now + self.LEASE_SECONDS, self.REQUEUE_BATCH, self._task_key("")]
+        )
         
-        if not result:
+        if not raw:
             return None
         
-        task_json = result[0]
-        task = json.loads(task_json)
-        
-        # Remove from queue
-        await self.redis_client.zrem(queue_name, task_json)
-        
-        # Update task status
-        task["status"] = "processing"
-        await self.redis_client.setex(
-            f"task:{task['id']}",
-            3600,
-            json.dumps(task)
+        # HGETALL comes back from Lua as a flat [field, value, ...] list
+        return self._decode_task(dict(zip(raw[::2], raw[1::2])))
+    
+    async def extend_lease(self, queue_name: str, task: Dict[str, Any]):
+        """Push a claimed task's lease deadline forward"""
+        await self.connect()
+        await self.redis_client.zadd(
+            self._processing_key(queue_name),
+            {task["id"]: time.time() + self.LEASE_SECONDS},
+            xx=True
         )
+    
+    async def ack(self, queue_name: str, task: Dict[str, Any]):
+        """Release a claimed task for good and wake a worker waiting for capacity"""
+        await self.connect()
+        await self.redis_client.zrem(self._processing_key(queue_name), task["id"])
+        await self._notify(queue_name)
+    
+    async def retry(self, queue_name: str, task: Dict[str, Any], priority: int):
+        """Hand a claimed task back to its queue under the same id"""
+        await self.connect()
         
-        return task
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.zrem(self._processing_key(queue_name), task["id"])
+            pipe.hset(self._task_key(task["id"]), mapping={"status": "queued", "priority": priority})
+            pipe.zadd(queue_name, {task["id"]: priority})
+            pipe.lpush(self._notify_key(queue_name), 1)
+            await pipe.execute()
+    
+    async def _keep_lease(self, queue_name: str, task: Dict[str, Any]):
+        while True:
+            await asyncio.sleep(self.LEASE_SECONDS / 3)
+            try:
+                await self.extend_lease(queue_name, task)
+            except Exception as e:
+                print(f"Lease renewal error for {task['id']}: {e}")
     
     async def get_task_status(self, task_id: str) -> Optional[Dict[str, Any]]:
         """Get task status"""
         await self.connect()
         
-        task_json = await self.redis_client.get(f"task:{task_id}")
-        if task_json:
-            return json.loads(task_json)
+        raw = await self.redis_client.hgetall(self._task_key(task_id))
+        if raw:
+            return self._decode_task(raw)
         return None
     
     async def update_task_status(self, task_id: str, status: str, result: Any = None):
         """Update task status"""
         await self.connect()
         
-        task_json = await self.redis_client.get(f"task:{task_id}")
-        if task_json:
-            task = json.loads(task_json)
-            task["status"] = status
-            task["updated_at"] = datetime.utcnow().isoformat()
-            
-            if result:
-                task["result"] = result
-            
+        key = self._task_key(task_id)
+        if not await self.redis_client.exists(key):
+            return
+        
+        changes = {
+            "status": status,
+            "updated_at": datetime.utcnow().isoformat()
+        }
+        if result:
+            changes["result"] = json.dumps(result)
+        
+        # Field updates in place - no read-modify-write of the whole task
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping=changes)
             if status == "failed":
-                task["attempts"] += 1
-            
-            await self.redis_client.setex(
-                f"task:{task_id}",
-                3600,
-                json.dumps(task)
-            )
+                pipe.hincrby(key, "attempts", 1)
+            pipe.expire(key, self.TASK_TTL_SECONDS)
+            await pipe.execute()
+    
+    async def update_task_progress(
+        self,
+        task_id: str,
+        increments: Optional[Dict[str, int]] = None,
+        fields: Optional[Dict[str, Any]] = None
+    ):
+        """
+        Record progress of a running task: increments are added to
+        progress_<name> counters, fields are set as they are. Both are
+        atomic per field, so concurrent sub-tasks can report independently.
+        """
+        await self.connect()
+        
+        key = self._task_key(task_id)
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            for name, amount in (increments or {}).items():
+                pipe.hincrby(key, f"progress_{name}", amount)
+            pipe.hset(key, mapping={**(fields or {}), "updated_at": datetime.utcnow().isoformat()})
+            pipe.expire(key, self.TASK_TTL_SECONDS)
+            await pipe.execute()
     
     async def get_queue_length(self, queue_name: str) -> int:
         """Get number of tasks in queue"""
@@ -152,33 +333,45 @@ class QueueService:
         """Get number of active tasks of a specific type"""
         await self.connect()
         
-        # Get all processing tasks
-        keys = await self.redis_client.keys(f"task:{task_type}:*")
-        processing_count = 0
-        
-        for key in keys:
-            task_json = await self.redis_client.get(key)
-            if task_json:
-                task = json.loads(task_json)
-                if task.get("status") == "processing":
-                    processing_count += 1
-        
-        return processing_count
+        # Tasks with a live lease in the processing set; expired leases are
+        # about to be re-queued and no longer hold a slot
+        return await self.redis_client.zcount(self._processing_key(task_type), time.time(), "+inf")
     
-    async def can_process(self, queue_name: str) -> bool:
-        """Check if we can process more tasks for this queue"""
+    async def get_queue_stats(self, queue_names: List[str]) -> Dict[str, Dict[str, int]]:
+        """Queued and processing counts for several queues in one round trip"""
         await self.connect()
         
-        active_count = await self.get_active_count(queue_name)
+        now = time.time()
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for queue_name in queue_names:
+                pipe.zcard(queue_name)
+                pipe.zcount(self._processing_key(queue_name), now, "+inf")
+            results = await pipe.execute()
         
+        return {
+            queue_name: {"queued": results[i * 2], "processing": results[i * 2 + 1]}
+            for i, queue_name in enumerate(queue_names)
+        }
+    
+    def get_capacity(self, queue_name: str) -> Optional[int]:
+        """Concurrency limit of a queue (None = unlimited)"""
         if queue_name == self.AI_GENERATION_QUEUE:
-            return active_count < self.MAX_CONCURRENT_AI_TASKS
+            return self.MAX_CONCURRENT_AI_TASKS
         elif queue_name == self.TEST_PROCESSING_QUEUE:
-            return active_count < self.MAX_CONCURRENT_TEST_TASKS
+            return self.MAX_CONCURRENT_TEST_TASKS
         elif queue_name == self.PROCTORING_QUEUE:
-            return active_count < self.MAX_CONCURRENT_PROCTORING
+            return self.MAX_CONCURRENT_PROCTORING
+        return None
+    
+    async def can_process(self, queue_name: str) -> bool:
+        """Check if we can process more tasks for this queue"""
+        await self.connect()
+        
+        capacity = self.get_capacity(queue_name)
+        if capacity is None:
+            return True
         
-        return True
+        return await self.get_active_count(queue_name) < capacity
     
     async def process_queue(self, queue_name: str, processor_func):
         """
@@ -186,38 +379,43 @@ class QueueService:
         
         Args:
             queue_name: Name of the queue to process
-            processor_func: Async function to process each task
+            processor_func: Async function called with each task's data and id
         """
         await self.connect()
         
         while True:
             try:
-                # Check if we can process more tasks
+                # Check if we can process more tasks; a finishing task wakes us
                 if not await self.can_process(queue_name):
-                    await asyncio.sleep(1)
+                    await self.wait_for_task(queue_name)
                     continue
                 
                 # Get next task
                 task = await self.dequeue(queue_name)
                 
                 if not task:
-                    await asyncio.sleep(1)
+                    # Sleep until enqueue() wakes us rather than polling
+                    await self.wait_for_task(queue_name)
                     continue
                 
-                # Process task
+                # Process task, renewing the lease while it runs
+                heartbeat = asyncio.create_task(self._keep_lease(queue_name, task))
+                should_retry = False
                 try:
-                    result = await processor_func(task["data"])
+                    result = await processor_func(task["data"], task["id"])
                     await self.update_task_status(task["id"], "completed", result)
                 except Exception as e:
                     await self.update_task_status(task["id"], "failed", str(e))
                     
                     # Retry if attempts < 3
-                    if task["attempts"] < 3:
-                        await self.enqueue(
-                            queue_name,
-                            task["data"],
-                            task["priority"] - 1  # Lower priority for retries
-                        )
+                    should_retry = task["attempts"] < self.MAX_RETRIES
+                finally:
+                    heartbeat.cancel()
+                    if should_retry:
+                        # Lower priority for retries
+                        await self.retry(queue_name, task, task["priority"] - 1)
+                    else:
+                        await self.ack(queue_name, task)
             
             except Exception as e:
                 print(f"Queue processing error: {e}")
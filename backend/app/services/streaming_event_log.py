@@ -0,0 +1,46 @@
+"""
+Streaming Event Log
+Counts every Socket.IO event by type. High-frequency traffic (video frames,
+ICE candidates) is logged only once per sample, so it costs a counter
+increment instead of a formatted log line per packet; control and audit
+events (joins, violations, terminations) are always logged. Verbose mode
+and the sample rate can be changed at runtime, for this process only
+"""
+import logging
+from typing import Dict, Any
+
+class StreamingEventLog:
+    def __init__(self, logger: logging.Logger, sample_every: int = 100, verbose: bool = False):
+        self.logger = logger
+        self.sample_every = max(1, sample_every)
+        self.verbose = verbose
+        self.counts: Dict[str, int] = {}
+    
+    def event(self, event: str, level: int = logging.INFO, sampled: bool = False, **fields):
+        """
+        Count one occurrence of event and log it. sampled=True marks a
+        per-packet event, logged only once per sample unless verbose.
+        """
+        count = self.counts.get(event, 0) + 1
+        self.counts[event] = count
+        
+        if sampled and not self.verbose and (count - 1) % self.sample_every:
+            return
+        if not self.logger.isEnabledFor(level):
+            return
+        
+        details = " ".join(f"{key}={value}" for key, value in fields.items())
+        self.logger.log(level, f"event={event} count={count} {details}".rstrip())
+    
+    def configure(self, verbose: bool = None, sample_every: int = None):
+        if verbose is not None:
+            self.verbose = verbose
+        if sample_every is not None:
+            self.sample_every = max(1, sample_every)
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            "verbose": self.verbose,
+            "sample_every": self.sample_every,
+            "events": dict(self.counts)
+        }
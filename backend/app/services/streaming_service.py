@@ -1,54 +1,413 @@
+import asyncio
+import json
+import time
 import socketio
-from typing import Dict, Set
+from collections import deque
+from typing import Dict, Set, List, Any, Optional, Tuple
 import logging
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.core.database import async_session_maker
+from app.core.security import decode_user_id
+from app.models import TestAttempt
+from app.services.frame_relay import FrameRelay
+from app.services.mosaic_service import MosaicService
+from app.services.proctoring_service import proctoring_service
+from app.services.streaming_event_log import StreamingEventLog
+from app.services.teacher_outbox import TeacherOutbox
+from app.services.violation_aggregator import violation_aggregator
+from app.services.queue_service import queue_service
+from app.services.waiting_room_service import waiting_room_service
 
 logger = logging.getLogger(__name__)
 
+class StudentSession:
+    """
+    State of one connected student socket. Only the most recent violations
+    are kept; the full history lives in proctoring_logs, so running counters
+    are enough here
+    """
+    __slots__ = (
+        "sid", "user_id", "name", "test_code", "test_id", "attempt_id", "status",
+        "verified_user_id", "verified_attempt_id", "verified_student_id",
+        "recent_violations", "violation_count", "violations_by_type", "violations_by_severity",
+        "last_seen"
+    )
+    
+    def __init__(
+        self,
+        sid: str,
+        user_id: Any,
+        name: Optional[str],
+        test_code: Optional[str] = None,
+        test_id: Any = None,
+        attempt_id: Any = None,
+        status: str = 'active',
+        history: int = 20,
+        verified_user_id: Optional[int] = None
+    ):
+        self.sid = sid
+        self.user_id = user_id
+        self.name = name
+        self.test_code = test_code
+        self.test_id = test_id
+        self.attempt_id = attempt_id
+        self.status = status
+        # User id from a valid JWT; user_id is only what the client claimed
+        self.verified_user_id = verified_user_id
+        self.verified_attempt_id = None
+        self.verified_student_id = None
+        
+        self.recent_violations = deque(maxlen=history)
+        self.violation_count = 0
+        self.violations_by_type: Dict[str, int] = {}
+        self.violations_by_severity: Dict[str, int] = {}
+        self.last_seen = time.monotonic()
+    
+    def touch(self):
+        self.last_seen = time.monotonic()
+    
+    def record_violation(self, violation: Dict[str, Any]):
+        self.recent_violations.append(violation)
+        self.violation_count += 1
+        violation_type = violation.get('type')
+        severity = violation.get('severity')
+        self.violations_by_type[violation_type] = self.violations_by_type.get(violation_type, 0) + 1
+        self.violations_by_severity[severity] = self.violations_by_severity.get(severity, 0) + 1
+
 class StreamingManager:
     def __init__(self):
+        # Clustered mode fans every emit out through Redis, so a teacher and
+        # their students may be connected to different workers or hosts
+        self.clustered = settings.STREAMING_CLUSTERED
+        client_manager = socketio.AsyncRedisManager(settings.REDIS_URL) if self.clustered else None
+        
         self.sio = socketio.AsyncServer(
             async_mode='asgi',
+            client_manager=client_manager,
             cors_allowed_origins='*',
-            logger=True,
-            engineio_logger=True
+            # Per-packet Socket.IO/engine.io logs are for debugging only
+            logger=settings.STREAMING_DEBUG_LOGGING,
+            engineio_logger=settings.STREAMING_DEBUG_LOGGING
+        )
+        self.events = StreamingEventLog(
+            logger,
+            sample_every=settings.STREAMING_LOG_SAMPLE_EVERY,
+            verbose=settings.STREAMING_DEBUG_LOGGING
         )
         
         self.test_rooms: Dict[str, Set[str]] = {}
-        self.student_info: Dict[str, Dict] = {}
-        self.teacher_rooms: Dict[str, str] = {}
+        self.student_info: Dict[str, StudentSession] = {}
+        # test_code -> sids of every teacher/proctor monitoring it
+        self.teacher_rooms: Dict[str, Set[str]] = {}
+        # sid -> (test_code, role), the reverse of the rooms above
+        self.sid_index: Dict[str, Tuple[str, str]] = {}
+        # sid -> user id of the JWT sent in the connect auth payload
+        self.authenticated: Dict[str, int] = {}
+        # test_code -> (fetched at, cluster-wide teacher sids), see _frame_viewers
+        self._teacher_cache: Dict[str, Tuple[float, List[str]]] = {}
+        self.MONITOR_ROLES = ('teacher', 'proctor')
+        
+        self._waiting_room_task: Optional[asyncio.Task] = None
+        self._sweep_task: Optional[asyncio.Task] = None
+        
+        self.frame_relay = FrameRelay(
+            self.sio,
+            max_fps=settings.STREAMING_MAX_VIEWER_FPS,
+            ack_timeout=settings.STREAMING_FRAME_ACK_TIMEOUT
+        )
+        self.mosaic = MosaicService(
+            self.sio,
+            fps=settings.STREAMING_MOSAIC_FPS,
+            tile_width=settings.STREAMING_MOSAIC_TILE_WIDTH,
+            tile_height=settings.STREAMING_MOSAIC_TILE_HEIGHT,
+            quality=settings.STREAMING_MOSAIC_JPEG_QUALITY,
+            workers=settings.STREAMING_MOSAIC_WORKERS,
+            clustered=self.clustered
+        )
+        self.teacher_outbox = TeacherOutbox(
+            self.sio,
+            flush_interval_ms=settings.STREAMING_ALERT_BATCH_INTERVAL_MS,
+            max_batch=settings.STREAMING_ALERT_MAX_BATCH
+        )
+        
+        self.REGISTRY_PREFIX = "streaming:test"
+        self.REGISTRY_TTL_SECONDS = 12 * 3600
+        self.TEACHER_CACHE_SECONDS = 1.0
     
     def get_asgi_app(self):
         return socketio.ASGIApp(self.sio)
     
+    def set_debug_logging(self, enabled: bool, sample_every: Optional[int] = None):
+        """
+        Switch per-packet Socket.IO logging and verbose event logs at runtime.
+        Applies to this worker process only.
+        """
+        level = logging.INFO if enabled else logging.ERROR
+        self.sio.logger.setLevel(level)
+        self.sio.eio.logger.setLevel(level)
+        self.events.configure(verbose=enabled, sample_every=sample_every)
+    
+    def _teacher_room(self, test_code: str) -> str:
+        return f"test_{test_code}_teacher"
+    
+    async def _emit_to_teachers(self, test_code: Optional[str], event: str, data: Dict[str, Any]):
+        """Emit to every teacher monitoring test_code, on any worker"""
+        if test_code:
+            await self.sio.emit(event, data, room=self._teacher_room(test_code))
+    
+    async def _alert_teachers(self, test_code: Optional[str], event: str, data: Dict[str, Any], severity: Optional[str]):
+        """Send a violation alert through the batching outbox"""
+        if test_code:
+            await self.teacher_outbox.send(self._teacher_room(test_code), event, data, severity=severity)
+    
+    async def _frame_viewers(self, test_code: Optional[str]) -> List[str]:
+        """
+        Sids of every teacher monitoring a test, which video frames are relayed
+        to one by one so each delivery is acknowledged. In clustered mode they
+        come from the teacher registry, re-read at most once a second.
+        """
+        if not test_code:
+            return []
+        if not self.clustered:
+            return list(self.teacher_rooms.get(test_code, ()))
+        
+        now = time.monotonic()
+        cached = self._teacher_cache.get(test_code)
+        if cached and now - cached[0] < self.TEACHER_CACHE_SECONDS:
+            return cached[1]
+        
+        await queue_service.connect()
+        teachers = list(await queue_service.redis_client.smembers(self._teacher_registry_key(test_code)))
+        self._teacher_cache[test_code] = (now, teachers)
+        return teachers
+    
+    def _index_sid(self, sid: str, test_code: str, role: str):
+        """Record which test and role a sid belongs to, leaving any earlier test"""
+        self._unindex_sid(sid)
+        self.sid_index[sid] = (test_code, role)
+        if role in self.MONITOR_ROLES:
+            self.teacher_rooms.setdefault(test_code, set()).add(sid)
+    
+    def _unindex_sid(self, sid: str) -> Tuple[Optional[str], Optional[str]]:
+        test_code, role = self.sid_index.pop(sid, (None, None))
+        if role in self.MONITOR_ROLES:
+            teachers = self.teacher_rooms.get(test_code)
+            if teachers is not None:
+                teachers.discard(sid)
+                if not teachers:
+                    del self.teacher_rooms[test_code]
+        elif role == 'student' and test_code in self.test_rooms:
+            self.test_rooms[test_code].discard(sid)
+        return test_code, role
+    
+    def _registry_key(self, test_code: str) -> str:
+        return f"{self.REGISTRY_PREFIX}:{test_code}:students"
+    
+    def _teacher_registry_key(self, test_code: str) -> str:
+        return f"{self.REGISTRY_PREFIX}:{test_code}:teachers"
+    
+    async def _register_teacher(self, test_code: str, sid: str):
+        """Publish a monitoring teacher so every worker can relay frames to it"""
+        if not self.clustered:
+            return
+        
+        await queue_service.connect()
+        key = self._teacher_registry_key(test_code)
+        async with queue_service.redis_client.pipeline(transaction=True) as pipe:
+            pipe.sadd(key, sid)
+            pipe.expire(key, self.REGISTRY_TTL_SECONDS)
+            await pipe.execute()
+    
+    async def _unregister_teacher(self, test_code: str, sid: str):
+        if not self.clustered:
+            return
+        
+        await queue_service.connect()
+        await queue_service.redis_client.srem(self._teacher_registry_key(test_code), sid)
+    
+    async def _register_student(self, test_code: str, sid: str, student: Dict[str, Any]):
+        """Publish a connected student to the cluster-wide registry"""
+        if not self.clustered:
+            return
+        
+        await queue_service.connect()
+        key = self._registry_key(test_code)
+        async with queue_service.redis_client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, sid, json.dumps(student))
+            pipe.expire(key, self.REGISTRY_TTL_SECONDS)
+            await pipe.execute()
+    
+    async def _enter_student_room(self, sid: str, token: Optional[str]) -> Optional[int]:
+        """
+        Join the student's personal push room. The room is keyed by the JWT
+        user id, never the one in the payload, so a socket cannot listen in on
+        another student's waiting-room updates. Returns the verified user id.
+        """
+        user_id = self.authenticated.get(sid) or decode_user_id(token)
+        if user_id is None:
+            await self.sio.emit('error', {'message': 'Authentication required'}, room=sid)
+            return None
+        
+        await self.sio.enter_room(sid, f"student_{user_id}")
+        return user_id
+    
+    async def _unregister_student(self, test_code: str, sid: str):
+        if not self.clustered:
+            return
+        
+        await queue_service.connect()
+        await queue_service.redis_client.hdel(self._registry_key(test_code), sid)
+    
+    async def _drop_student(self, sid: str, notify: bool = True) -> Optional[StudentSession]:
+        """
+        Forget a student session everywhere it is tracked: the test room, the
+        clustered registry, the mosaic, the frame relay and the sid index.
+        Used on disconnect, on termination and by the idle sweep.
+        """
+        session = self.student_info.pop(sid, None)
+        if session is None:
+            return None
+        
+        test_code = session.test_code
+        if test_code in self.test_rooms:
+            self.test_rooms[test_code].discard(sid)
+            if not self.test_rooms[test_code]:
+                del self.test_rooms[test_code]
+        self._unindex_sid(sid)
+        self.frame_relay.forget(sid)
+        
+        if test_code:
+            self.mosaic.remove_student(test_code, sid)
+            await self._unregister_student(test_code, sid)
+            if notify:
+                await self._emit_to_teachers(test_code, 'student_left', {
+                    'student_id': session.user_id,
+                    'student_name': session.name
+                })
+        return session
+    
+    async def _get_students(self, test_code: str) -> List[Dict[str, Any]]:
+        """Students connected to test_code - cluster-wide in clustered mode"""
+        if self.clustered:
+            await queue_service.connect()
+            values = await queue_service.redis_client.hvals(self._registry_key(test_code))
+            return [json.loads(value) for value in values]
+        
+        students = []
+        for student_sid in self.test_rooms.get(test_code, ()):
+            if student_sid in self.student_info:
+                student = self.student_info[student_sid]
+                students.append({
+                    'sid': student_sid,
+                    'student_id': student.user_id,
+                    'student_name': student.name,
+                    'attempt_id': student.attempt_id
+                })
+        return students
+    
+    async def start(self):
+        """Start pushing waiting-room transitions to students' sockets and the mosaic loop"""
+        if not self._waiting_room_task:
+            self._waiting_room_task = asyncio.create_task(self._relay_waiting_room_events())
+        if not self._sweep_task:
+            self._sweep_task = asyncio.create_task(self._sweep_loop())
+        await self.mosaic.start()
+        await self.teacher_outbox.start()
+    
+    async def stop(self):
+        await self.teacher_outbox.stop()
+        await self.mosaic.stop()
+        for task in (self._waiting_room_task, self._sweep_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._waiting_room_task = None
+        self._sweep_task = None
+    
+    async def sweep_sessions(self) -> int:
+        """
+        Drop sessions that have been idle past STREAMING_SESSION_IDLE_SECONDS
+        and whose socket is gone (e.g. a disconnect that never reached us),
+        including their entry in the clustered student registry
+        """
+        cutoff = time.monotonic() - settings.STREAMING_SESSION_IDLE_SECONDS
+        stale = [
+            sid for sid, session in self.student_info.items()
+            if session.last_seen < cutoff and not self.sio.manager.is_connected(sid, '/')
+        ]
+        
+        for sid in stale:
+            self.authenticated.pop(sid, None)
+            try:
+                await self._drop_student(sid)
+            except Exception as e:
+                logger.warning(f"Failed to clean up swept session {sid}: {e}")
+        
+        for test_code in [code for code in self._teacher_cache if code not in self.test_rooms]:
+            del self._teacher_cache[test_code]
+        
+        return len(stale)
+    
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(settings.STREAMING_SESSION_SWEEP_INTERVAL_SECONDS)
+            try:
+                swept = await self.sweep_sessions()
+                if swept:
+                    logger.info(f"Swept {swept} stale student sessions")
+            except Exception as e:
+                logger.error(f"Session sweep error: {e}")
+    
+    async def _relay_waiting_room_events(self):
+        """
+        Forward waiting-room pub/sub events to the student's personal room.
+        Every worker runs this relay, so a student is reached whichever
+        worker holds their socket. ignore_queue keeps clustered mode from
+        re-broadcasting what every worker already received.
+        """
+        while True:
+            try:
+                async for event in waiting_room_service.listen():
+                    await self.sio.emit('waiting_room_status', {
+                        'test_id': event['test_id'],
+                        'student_id': event['student_id'],
+                        'status': event['status'],
+                        'in_waiting_room': event['event'] != 'removed',
+                        'details': event['student']
+                    }, room=f"student_{event['student_id']}", ignore_queue=True)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Waiting room relay error: {e}")
+                await asyncio.sleep(1)
+    
     async def setup_handlers(self):
         @self.sio.event
-        async def connect(sid, environ):
-            logger.info(f"Client connected: {sid}")
+        async def connect(sid, environ, auth=None):
+            user_id = decode_user_id(auth.get('token') if isinstance(auth, dict) else None)
+            if user_id is not None:
+                self.authenticated[sid] = user_id
+            
+            self.events.event('connect', sid=sid, authenticated=user_id is not None)
             await self.sio.emit('connected', {'sid': sid}, room=sid)
         
         @self.sio.event
         async def disconnect(sid):
-            logger.info(f"Client disconnected: {sid}")
+            self.events.event('disconnect', sid=sid)
             
-            if sid in self.student_info:
-                student_data = self.student_info[sid]
-                test_code = student_data.get('test_code')
-                
-                if test_code and test_code in self.test_rooms:
-                    self.test_rooms[test_code].discard(sid)
-                    
-                    teacher_sid = self.teacher_rooms.get(test_code)
-                    if teacher_sid:
-                        await self.sio.emit('student_left', {
-                            'student_id': student_data.get('user_id'),
-                            'student_name': student_data.get('name')
-                        }, room=teacher_sid)
-                
-                del self.student_info[sid]
+            self.frame_relay.forget(sid)
+            await self.mosaic.remove_viewer(sid)
+            self.authenticated.pop(sid, None)
             
-            if sid in self.teacher_rooms.values():
-                test_code = [k for k, v in self.teacher_rooms.items() if v == sid][0]
-                del self.teacher_rooms[test_code]
+            await self._drop_student(sid)
+            test_code, role = self._unindex_sid(sid)
+            if role in self.MONITOR_ROLES:
+                await self._unregister_teacher(test_code, sid)
         
         @self.sio.event
         async def join_test_as_student(sid, data):
@@ -61,79 +420,180 @@ class StreamingManager:
                 await self.sio.emit('error', {'message': 'Test code required'}, room=sid)
                 return
             
+            self._index_sid(sid, test_code, 'student')
+            
             if test_code not in self.test_rooms:
                 self.test_rooms[test_code] = set()
             
             self.test_rooms[test_code].add(sid)
-            self.student_info[sid] = {
-                'user_id': user_id,
-                'name': name,
-                'test_code': test_code,
-                'attempt_id': attempt_id,
-                'violations': []
-            }
-            
             await self.sio.enter_room(sid, f"test_{test_code}")
-            
-            teacher_sid = self.teacher_rooms.get(test_code)
-            if teacher_sid:
-                await self.sio.emit('student_joined', {
-                    'sid': sid,
-                    'student_id': user_id,
-                    'student_name': name,
-                    'attempt_id': attempt_id
-                }, room=teacher_sid)
+            verified_user_id = await self._enter_student_room(sid, data.get('token'))
+            
+            self.student_info[sid] = StudentSession(
+                sid,
+                user_id,
+                name,
+                test_code=test_code,
+                attempt_id=attempt_id,
+                history=settings.STREAMING_VIOLATION_HISTORY,
+                verified_user_id=verified_user_id
+            )
+            
+            await self._register_student(test_code, sid, {
+                'sid': sid,
+                'student_id': user_id,
+                'student_name': name,
+                'attempt_id': attempt_id
+            })
+            
+            await self._emit_to_teachers(test_code, 'student_joined', {
+                'sid': sid,
+                'student_id': user_id,
+                'student_name': name,
+                'attempt_id': attempt_id
+            })
             
             await self.sio.emit('joined_test', {'test_code': test_code}, room=sid)
-            logger.info(f"Student {name} joined test {test_code}")
+            self.events.event('join_test_as_student', test_code=test_code, student=name)
         
         @self.sio.event
         async def join_test_as_teacher(sid, data):
+            """
+            Start monitoring a test. Full video arrives as 'student_video_frame'
+            at up to STREAMING_MAX_VIEWER_FPS per student. The client must call
+            the event's ack callback for every frame: the next frame of that
+            student is held until it does (or until STREAMING_FRAME_ACK_TIMEOUT),
+            so a slow client is never flooded.
+            """
             test_code = data.get('test_code')
+            role = data.get('role', 'teacher')
             
             if not test_code:
                 await self.sio.emit('error', {'message': 'Test code required'}, room=sid)
                 return
             
-            self.teacher_rooms[test_code] = sid
+            if role not in self.MONITOR_ROLES:
+                await self.sio.emit('error', {'message': 'Role must be teacher or proctor'}, room=sid)
+                return
+            
+            # Any number of teachers and proctors can monitor the same test
+            previous_test, _ = self.sid_index.get(sid, (None, None))
+            if previous_test and previous_test != test_code:
+                await self.sio.leave_room(sid, f"test_{previous_test}_teacher")
+                await self._unregister_teacher(previous_test, sid)
+            
+            self._index_sid(sid, test_code, role)
             await self.sio.enter_room(sid, f"test_{test_code}_teacher")
+            await self._register_teacher(test_code, sid)
             
-            students = []
-            if test_code in self.test_rooms:
-                for student_sid in self.test_rooms[test_code]:
-                    if student_sid in self.student_info:
-                        student = self.student_info[student_sid]
-                        students.append({
-                            'sid': student_sid,
-                            'student_id': student['user_id'],
-                            'student_name': student['name'],
-                            'attempt_id': student['attempt_id']
-                        })
+            students = await self._get_students(test_code)
             
             await self.sio.emit('monitoring_started', {
                 'test_code': test_code,
                 'students': students
             }, room=sid)
             
-            logger.info(f"Teacher joined monitoring for test {test_code}")
+            self.events.event('join_test_as_teacher', test_code=test_code, role=role)
         
         @self.sio.event
         async def video_frame(sid, data):
+            self.events.event('video_frame', sampled=True)
             if sid not in self.student_info:
                 return
             
             student_data = self.student_info[sid]
-            test_code = student_data.get('test_code')
-            
-            teacher_sid = self.teacher_rooms.get(test_code)
-            if teacher_sid:
-                await self.sio.emit('student_video_frame', {
+            student_data.touch()
+            test_code = student_data.test_code
+            
+            frame = data.get('frame')
+            self.mosaic.offer(test_code, sid, student_data.user_id, student_data.name, frame)
+            
+            # Teachers in mosaic mode only get full frames of students they focus on
+            viewers = [
+                teacher_sid for teacher_sid in await self._frame_viewers(test_code)
+                if self.mosaic.wants_full_frame(test_code, sid, teacher_sid)
+            ]
+            if viewers:
+                # Only the newest frame per viewer is kept; older ones are dropped
+                self.frame_relay.push(sid, viewers, {
                     'sid': sid,
-                    'student_id': student_data['user_id'],
-                    'student_name': student_data['name'],
-                    'frame': data.get('frame'),
+                    'student_id': student_data.user_id,
+                    'student_name': student_data.name,
+                    'frame': frame,
                     'timestamp': data.get('timestamp')
-                }, room=teacher_sid)
+                })
+        
+        @self.sio.event
+        async def set_view_mode(sid, data):
+            """Teacher switches between individual feeds and the mosaic grid"""
+            test_code = data.get('test_code')
+            mode = data.get('mode', 'individual')
+            
+            if not test_code or mode not in ('individual', 'mosaic'):
+                await self.sio.emit('error', {'message': 'Test code and a valid mode required'}, room=sid)
+                return
+            
+            await self.mosaic.set_view(test_code, sid, mode, data.get('focus', []))
+            
+            if mode == 'mosaic':
+                await self.sio.enter_room(sid, f"test_{test_code}_mosaic")
+            else:
+                await self.sio.leave_room(sid, f"test_{test_code}_mosaic")
+            
+            await self.sio.emit('view_mode_changed', {
+                'test_code': test_code,
+                'mode': mode,
+                'focus': data.get('focus', [])
+            }, room=sid)
+        
+        @self.sio.event
+        async def analyze_frame_binary(sid, data):
+            """Analyze a raw JPEG/WebP frame sent as a binary attachment"""
+            self.events.event('analyze_frame_binary', sampled=True)
+            if sid not in self.student_info:
+                return
+            
+            student_data = self.student_info[sid]
+            student_data.touch()
+            frame = data.get('frame') if isinstance(data, dict) else data
+            
+            if not isinstance(frame, (bytes, bytearray)):
+                await self.sio.emit('error', {'message': 'Binary frame required'}, room=sid)
+                return
+            
+            attempt_id = student_data.attempt_id
+            
+            # Frames write proctoring_logs, so only a JWT-verified user may send them
+            if student_data.verified_user_id is None:
+                await self.sio.emit('error', {'message': 'Authentication required'}, room=sid)
+                return
+            
+            # Check the attempt belongs to this student once per connection
+            if attempt_id and student_data.verified_attempt_id != attempt_id:
+                async with async_session_maker() as db:
+                    result = await db.execute(
+                        select(TestAttempt).where(TestAttempt.id == attempt_id)
+                    )
+                    attempt = result.scalar_one_or_none()
+                
+                if not attempt or attempt.student_id != student_data.verified_user_id:
+                    await self.sio.emit('error', {'message': 'Not authorized for this attempt'}, room=sid)
+                    return
+                
+                student_data.verified_attempt_id = attempt_id
+                student_data.verified_student_id = attempt.student_id
+            
+            analysis = await proctoring_service.analyze_frame(frame, attempt_id=attempt_id)
+            
+            if attempt_id:
+                await violation_aggregator.observe(attempt_id, student_data.verified_student_id, analysis)
+            
+            await self.sio.emit('frame_analysis', analysis, room=sid)
+            
+            await self._emit_to_teachers(student_data.test_code, 'face_detection_update', {
+                'sid': sid,
+                'face_count': analysis['face_count']
+            })
         
         @self.sio.event
         async def violation_detected(sid, data):
@@ -141,7 +601,8 @@ class StreamingManager:
                 return
             
             student_data = self.student_info[sid]
-            test_code = student_data.get('test_code')
+            student_data.touch()
+            test_code = student_data.test_code
             
             violation = {
                 'type': data.get('type'),
@@ -150,51 +611,55 @@ class StreamingManager:
                 'details': data.get('details')
             }
             
-            student_data['violations'].append(violation)
+            student_data.record_violation(violation)
             
-            teacher_sid = self.teacher_rooms.get(test_code)
-            if teacher_sid:
-                await self.sio.emit('student_violation', {
-                    'sid': sid,
-                    'student_id': student_data['user_id'],
-                    'student_name': student_data['name'],
-                    'violation': violation
-                }, room=teacher_sid)
+            await self._alert_teachers(test_code, 'student_violation', {
+                'sid': sid,
+                'student_id': student_data.user_id,
+                'student_name': student_data.name,
+                'violation': violation
+            }, violation['severity'])
             
-            logger.warning(f"Violation detected for student {student_data['name']}: {violation['type']}")
+            self.events.event(
+                'violation_detected', logging.WARNING,
+                student=student_data.name, type=violation['type'], severity=violation['severity']
+            )
         
         @self.sio.event
         async def student_in_waiting_room(sid, data):
             """Handle student entering waiting room"""
-            logger.info(f"Student {data.get('name')} entered waiting room")
+            self.events.event('student_in_waiting_room', student=data.get('name'))
+            
+            # Waiting-room status changes are pushed to this room
+            verified_user_id = await self._enter_student_room(sid, data.get('token'))
             
             # Store waiting room info
-            self.student_info[sid] = {
-                'user_id': data.get('user_id'),
-                'name': data.get('name'),
-                'test_id': data.get('test_id'),
-                'attempt_id': data.get('attempt_id'),
-                'status': 'waiting',
-                'sid': sid
-            }
+            self.student_info[sid] = StudentSession(
+                sid,
+                data.get('user_id'),
+                data.get('name'),
+                test_id=data.get('test_id'),
+                attempt_id=data.get('attempt_id'),
+                status='waiting',
+                history=settings.STREAMING_VIOLATION_HISTORY,
+                verified_user_id=verified_user_id
+            )
             
             # Notify teacher monitoring this test
             test_code = data.get('test_code')
             if test_code:
-                teacher_sid = self.teacher_rooms.get(test_code)
-                if teacher_sid:
-                    await self.sio.emit('student_in_waiting_room', {
-                        'sid': sid,
-                        'name': data.get('name'),
-                        'user_id': data.get('user_id'),
-                        'test_id': data.get('test_id'),
-                        'attempt_id': data.get('attempt_id')
-                    }, room=teacher_sid)
+                await self._emit_to_teachers(test_code, 'student_in_waiting_room', {
+                    'sid': sid,
+                    'name': data.get('name'),
+                    'user_id': data.get('user_id'),
+                    'test_id': data.get('test_id'),
+                    'attempt_id': data.get('attempt_id')
+                })
         
         @self.sio.event
         async def teacher_pause_student(sid, data):
             """Teacher manually pauses a student"""
-            logger.info(f"Teacher pausing student {data.get('student_id')}")
+            self.events.event('teacher_pause_student', student_id=data.get('student_id'))
             
             student_sid = data.get('sid')
             if student_sid:
@@ -207,7 +672,7 @@ class StreamingManager:
         @self.sio.event
         async def approve_student(sid, data):
             """Teacher approves student to continue test"""
-            logger.info(f"Teacher approved student {data.get('student_id')}")
+            self.events.event('approve_student', student_id=data.get('student_id'))
             
             student_sid = data.get('sid')
             if student_sid:
@@ -218,12 +683,12 @@ class StreamingManager:
                 
                 # Update status
                 if student_sid in self.student_info:
-                    self.student_info[student_sid]['status'] = 'active'
+                    self.student_info[student_sid].status = 'active'
         
         @self.sio.event
         async def teacher_terminate_student(sid, data):
             """Teacher terminates student's test"""
-            logger.info(f"Teacher terminated student {data.get('student_id')}")
+            self.events.event('teacher_terminate_student', student_id=data.get('student_id'))
             
             student_sid = data.get('sid')
             if student_sid:
@@ -233,13 +698,12 @@ class StreamingManager:
                 }, room=student_sid)
                 
                 # Clean up
-                if student_sid in self.student_info:
-                    del self.student_info[student_sid]
+                await self._drop_student(student_sid)
         
         @self.sio.event
         async def terminate_from_waiting(sid, data):
             """Terminate student from waiting room"""
-            logger.info(f"Terminating student {data.get('student_id')} from waiting room")
+            self.events.event('terminate_from_waiting', student_id=data.get('student_id'))
             
             student_sid = data.get('sid')
             if student_sid:
@@ -247,58 +711,55 @@ class StreamingManager:
                     'reason': 'Test terminated by teacher'
                 }, room=student_sid)
                 
-                if student_sid in self.student_info:
-                    del self.student_info[student_sid]
+                await self._drop_student(student_sid)
         
         @self.sio.event
         async def student_flagged(sid, data):
             """Student flagged by ML system"""
-            logger.warning(f"Student flagged by ML: {data}")
+            self.events.event('student_flagged', logging.WARNING, sid=sid, type=data.get('type'), severity=data.get('severity'))
             
             if sid not in self.student_info:
                 return
             
             student_data = self.student_info[sid]
-            test_code = student_data.get('test_code')
+            student_data.touch()
+            test_code = student_data.test_code
             
             # Notify teacher
-            teacher_sid = self.teacher_rooms.get(test_code)
-            if teacher_sid:
-                await self.sio.emit('student_flagged', {
-                    'sid': sid,
-                    'student_name': student_data['name'],
-                    'type': data.get('type'),
-                    'severity': data.get('severity'),
-                    'details': data.get('details'),
-                    'reasons': data.get('reasons', [])
-                }, room=teacher_sid)
+            await self._alert_teachers(test_code, 'student_flagged', {
+                'sid': sid,
+                'student_name': student_data.name,
+                'type': data.get('type'),
+                'severity': data.get('severity'),
+                'details': data.get('details'),
+                'reasons': data.get('reasons', [])
+            }, data.get('severity'))
         
         # WebRTC Signaling handlers
         @self.sio.event
         async def webrtc_offer(sid, data):
             """Forward WebRTC offer from student to teacher"""
-            logger.info(f"Received WebRTC offer from {sid}")
+            self.events.event('webrtc_offer', sid=sid)
             
             if sid not in self.student_info:
                 return
             
             student_data = self.student_info[sid]
-            test_code = student_data.get('test_code')
-            teacher_sid = self.teacher_rooms.get(test_code)
-            
-            if teacher_sid:
-                await self.sio.emit('webrtc_offer', {
-                    'sid': sid,
-                    'student_id': student_data['user_id'],
-                    'student_name': student_data['name'],
-                    'offer': data.get('offer'),
-                    'stream_type': data.get('stream_type')  # 'camera' or 'screen'
-                }, room=teacher_sid)
+            student_data.touch()
+            test_code = student_data.test_code
+            
+            await self._emit_to_teachers(test_code, 'webrtc_offer', {
+                'sid': sid,
+                'student_id': student_data.user_id,
+                'student_name': student_data.name,
+                'offer': data.get('offer'),
+                'stream_type': data.get('stream_type')  # 'camera' or 'screen'
+            })
         
         @self.sio.event
         async def webrtc_answer(sid, data):
             """Forward WebRTC answer from teacher to student"""
-            logger.info(f"Received WebRTC answer from teacher to {data.get('student_sid')}")
+            self.events.event('webrtc_answer', student_sid=data.get('student_sid'))
             
             student_sid = data.get('student_sid')
             if student_sid:
@@ -310,21 +771,21 @@ class StreamingManager:
         @self.sio.event
         async def webrtc_ice_candidate(sid, data):
             """Forward ICE candidate between peers"""
-            logger.info(f"Received ICE candidate from {sid}")
+            self.events.event('webrtc_ice_candidate', sampled=True, sid=sid)
             
             # Check if sender is student or teacher
-            if sid in self.student_info:
+            _, role = self.sid_index.get(sid, (None, None))
+            if role == 'student' and sid in self.student_info:
                 # Student -> Teacher
                 student_data = self.student_info[sid]
-                test_code = student_data.get('test_code')
-                teacher_sid = self.teacher_rooms.get(test_code)
+                student_data.touch()
+                test_code = student_data.test_code
                 
-                if teacher_sid:
-                    await self.sio.emit('webrtc_ice_candidate', {
-                        'sid': sid,
-                        'candidate': data.get('candidate'),
-                        'stream_type': data.get('stream_type')
-                    }, room=teacher_sid)
+                await self._emit_to_teachers(test_code, 'webrtc_ice_candidate', {
+                    'sid': sid,
+                    'candidate': data.get('candidate'),
+                    'stream_type': data.get('stream_type')
+                })
             else:
                 # Teacher -> Student
                 student_sid = data.get('student_sid')
@@ -0,0 +1,86 @@
+"""
+Teacher Outbox
+Coalesces violation alerts bound for a test's teachers into one
+'student_violations_batch' emit per interval, so a burst of alerts from a
+whole class costs one Socket.IO packet instead of one per student. Critical
+alerts skip the outbox and are emitted at once
+"""
+import asyncio
+from typing import Dict, Any, List, Optional
+
+class TeacherOutbox:
+    def __init__(self, sio, flush_interval_ms: int = 250, max_batch: int = 500):
+        self.sio = sio
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self.IMMEDIATE_SEVERITIES = ('critical',)
+        
+        # room -> alerts waiting for the next flush
+        self._pending: Dict[str, List[Dict[str, Any]]] = {}
+        self._task: Optional[asyncio.Task] = None
+        
+        # Metrics
+        self.events_batched = 0
+        self.events_immediate = 0
+        self.batches_sent = 0
+    
+    async def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        
+        await self.flush()
+    
+    async def send(self, room: str, event: str, data: Dict[str, Any], severity: Optional[str] = None):
+        """Queue an alert for room, or emit it right away if it is critical"""
+        if severity in self.IMMEDIATE_SEVERITIES:
+            self.events_immediate += 1
+            await self.sio.emit(event, data, room=room)
+            return
+        
+        pending = self._pending.setdefault(room, [])
+        pending.append({'event': event, 'data': data})
+        self.events_batched += 1
+        
+        if len(pending) >= self.max_batch:
+            await self._flush_room(room)
+    
+    async def flush(self):
+        for room in list(self._pending):
+            await self._flush_room(room)
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            "pending_events": sum(len(events) for events in self._pending.values()),
+            "events_batched": self.events_batched,
+            "events_immediate": self.events_immediate,
+            "batches_sent": self.batches_sent,
+            "avg_batch_size": round(self.events_batched / self.batches_sent, 2) if self.batches_sent else 0.0
+        }
+    
+    async def _flush_room(self, room: str):
+        events = self._pending.pop(room, None)
+        if not events:
+            return
+        
+        self.batches_sent += 1
+        await self.sio.emit('student_violations_batch', {
+            'events': events,
+            'count': len(events)
+        }, room=room)
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Teacher outbox flush error: {e}")
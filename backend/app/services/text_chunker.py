@@ -0,0 +1,86 @@
+"""
+Text Chunker
+Splits long material text into chunks that fit a token budget, breaking at
+paragraph boundaries where possible, then at sentences, then at words
+"""
+import hashlib
+import re
+from typing import List, Iterator
+
+# Rough size of a token in English text, matching AIService's estimate
+CHARS_PER_TOKEN = 4
+
+def chunk_text(text: str, max_tokens: int) -> List[str]:
+    """Pack paragraphs greedily into chunks of at most max_tokens"""
+    max_chars = max(1, max_tokens * CHARS_PER_TOKEN)
+    text = text.strip()
+    if len(text) <= max_chars:
+        return [text] if text else []
+    
+    chunks = []
+    current = ""
+    for piece in _pieces(text, max_chars):
+        if current and len(current) + 2 + len(piece) > max_chars:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f"{current}\n\n{piece}" if current else piece
+    
+    if current:
+        chunks.append(current)
+    return chunks
+
+def content_defined_chunks(text: str, target_tokens: int) -> List[str]:
+    """
+    Split text where the content itself says so: a chunk ends after a
+    paragraph whose hash falls under a threshold proportional to its
+    length, so chunks average target_tokens. Boundaries do not depend on
+    what came earlier in the document, so an edit only changes the chunk it
+    falls in and the other chunks stay byte-identical.
+    """
+    target_chars = max(1, target_tokens * CHARS_PER_TOKEN)
+    min_chars = target_chars // 4
+    max_chars = target_chars * 2
+    
+    chunks = []
+    current: List[str] = []
+    size = 0
+    for piece in _pieces(text.strip(), max_chars):
+        if current and size + 2 + len(piece) > max_chars:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        
+        size += len(piece) + (2 if current else 0)
+        current.append(piece)
+        
+        if size >= min_chars and _is_boundary(piece, target_chars):
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+    
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+def _is_boundary(piece: str, target_chars: int) -> bool:
+    digest = hashlib.blake2b(piece.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2 ** 64 < len(piece) / target_chars
+
+def _pieces(text: str, max_chars: int) -> Iterator[str]:
+    """Paragraphs, with any paragraph over the budget split into sentences or words"""
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            yield paragraph
+            continue
+        
+        for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+            while len(sentence) > max_chars:
+                cut = sentence.rfind(" ", 0, max_chars)
+                if cut <= 0:
+                    cut = max_chars
+                yield sentence[:cut]
+                sentence = sentence[cut:].lstrip()
+            if sentence:
+                yield sentence
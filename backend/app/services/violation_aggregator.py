@@ -0,0 +1,148 @@
+"""
+Violation Aggregator
+Merges consecutive identical proctoring violations from frame analysis into
+single episodes, so a student looking away for 10 seconds produces one
+ProctoringLog row with start/end/count instead of one row per frame
+"""
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+
+from app.core.config import settings
+from app.services.proctoring_log_writer import proctoring_log_writer
+
+class ViolationEpisode:
+    """A run of consecutive frames showing the same violation type"""
+    __slots__ = (
+        "attempt_id", "student_id", "violation_type", "severity",
+        "description", "started_at", "ended_at", "count", "metadata"
+    )
+    
+    def __init__(self, attempt_id: int, student_id: int, violation: Dict[str, Any], metadata: Dict[str, Any], now: datetime):
+        self.attempt_id = attempt_id
+        self.student_id = student_id
+        self.violation_type = violation["type"]
+        self.severity = violation["severity"]
+        self.description = violation["description"]
+        self.started_at = now
+        self.ended_at = now
+        self.count = 1
+        self.metadata = metadata
+
+class ViolationAggregator:
+    def __init__(
+        self,
+        idle_seconds: float = 5,
+        max_window_seconds: float = 60,
+        flush_interval_seconds: float = 2
+    ):
+        # Episodes with no new frame for idle_seconds are closed by the timer
+        self.idle = timedelta(seconds=idle_seconds)
+        # Long-running episodes are closed (and a new one opened) after this
+        self.max_window = timedelta(seconds=max_window_seconds)
+        self.flush_interval = flush_interval_seconds
+        
+        self.open_episodes: Dict[int, Dict[str, ViolationEpisode]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+    
+    async def start(self):
+        if not self._flush_task:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+    
+    async def stop(self):
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        
+        # Persist whatever is still open so nothing is lost on shutdown
+        remaining = [
+            episode
+            for episodes in self.open_episodes.values()
+            for episode in episodes.values()
+        ]
+        self.open_episodes.clear()
+        await self._write(remaining)
+    
+    async def observe(self, attempt_id: int, student_id: int, analysis: Dict[str, Any]):
+        """Fold one frame's violations into the attempt's open episodes"""
+        now = datetime.utcnow()
+        current = {violation["type"]: violation for violation in analysis["violations"]}
+        episodes = self.open_episodes.setdefault(attempt_id, {})
+        metadata = {
+            "face_count": analysis["face_count"],
+            "head_pose": analysis["head_pose"],
+            "gaze_direction": analysis["gaze_direction"],
+        }
+        
+        # A violation type missing from this frame ends its episode
+        closed = [
+            episodes.pop(violation_type)
+            for violation_type in list(episodes)
+            if violation_type not in current
+        ]
+        
+        for violation_type, violation in current.items():
+            episode = episodes.get(violation_type)
+            if episode is None:
+                episodes[violation_type] = ViolationEpisode(attempt_id, student_id, violation, metadata, now)
+            else:
+                episode.ended_at = now
+                episode.count += 1
+                episode.metadata = metadata
+        
+        if not episodes:
+            del self.open_episodes[attempt_id]
+        
+        if closed:
+            await self._write(closed)
+    
+    async def flush_expired(self):
+        """Close episodes that went idle or outgrew the aggregation window"""
+        now = datetime.utcnow()
+        closed = []
+        
+        for attempt_id in list(self.open_episodes):
+            episodes = self.open_episodes[attempt_id]
+            for violation_type in list(episodes):
+                episode = episodes[violation_type]
+                if now - episode.ended_at > self.idle or now - episode.started_at > self.max_window:
+                    closed.append(episodes.pop(violation_type))
+            if not episodes:
+                del self.open_episodes[attempt_id]
+        
+        await self._write(closed)
+    
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush_expired()
+            except Exception as e:
+                print(f"Violation flush error: {e}")
+    
+    async def _write(self, episodes: List[ViolationEpisode]):
+        for episode in episodes:
+            await proctoring_log_writer.write(
+                attempt_id=episode.attempt_id,
+                student_id=episode.student_id,
+                violation_type=episode.violation_type,
+                severity=episode.severity,
+                description=episode.description,
+                log_metadata={
+                    **episode.metadata,
+                    "started_at": episode.started_at.isoformat(),
+                    "ended_at": episode.ended_at.isoformat(),
+                    "frame_count": episode.count,
+                },
+                timestamp=episode.started_at
+            )
+
+violation_aggregator = ViolationAggregator(
+    idle_seconds=settings.PROCTORING_VIOLATION_IDLE_SECONDS,
+    max_window_seconds=settings.PROCTORING_VIOLATION_MAX_WINDOW_SECONDS,
+    flush_interval_seconds=settings.PROCTORING_VIOLATION_FLUSH_INTERVAL_SECONDS
+)
@@ -0,0 +1,170 @@
+"""
+Waiting Room Service
+Keeps waiting-room state in Redis (one hash per test, one field per student)
+so every worker and node sees the same students, and publishes status
+changes over pub/sub
+"""
+import asyncio
+import json
+from typing import Dict, Any, List, Optional, AsyncIterator
+from redis.exceptions import WatchError
+
+from app.services.queue_service import queue_service
+
+class WaitingRoomService:
+    def __init__(self):
+        self.KEY_PREFIX = "waiting_room"
+        # Waiting rooms outlive any single exam session, then expire
+        self.TTL_SECONDS = 12 * 3600
+    
+    def _key(self, test_id: int) -> str:
+        return f"{self.KEY_PREFIX}:{test_id}"
+    
+    def _channel(self, test_id: int) -> str:
+        return f"{self.KEY_PREFIX}:{test_id}:events"
+    
+    async def _redis(self):
+        await queue_service.connect()
+        return queue_service.redis_client
+    
+    async def add_student(self, test_id: int, student_data: Dict[str, Any]):
+        """Put a student in the waiting room and announce it"""
+        redis = await self._redis()
+        key = self._key(test_id)
+        
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.hset(key, str(student_data["student_id"]), json.dumps(student_data))
+            pipe.expire(key, self.TTL_SECONDS)
+            pipe.publish(self._channel(test_id), self._event("added", test_id, student_data))
+            await pipe.execute()
+    
+    async def get_students(self, test_id: int) -> List[Dict[str, Any]]:
+        redis = await self._redis()
+        return [json.loads(value) for value in await redis.hvals(self._key(test_id))]
+    
+    async def get_student(self, test_id: int, student_id: int) -> Optional[Dict[str, Any]]:
+        redis = await self._redis()
+        value = await redis.hget(self._key(test_id), str(student_id))
+        return json.loads(value) if value else None
+    
+    async def update_student(self, test_id: int, student_id: int, **changes) -> Optional[Dict[str, Any]]:
+        """
+        Apply changes to a waiting student and publish the new state. The
+        read and write are one optimistic transaction, so a student removed
+        (terminated) in between is not written back; None is returned then.
+        """
+        redis = await self._redis()
+        key = self._key(test_id)
+        
+        async with redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    value = await pipe.hget(key, str(student_id))
+                    if value is None:
+                        await pipe.unwatch()
+                        return None
+                    
+                    student_data = json.loads(value)
+                    student_data.update(changes)
+                    
+                    pipe.multi()
+                    pipe.hset(key, str(student_id), json.dumps(student_data))
+                    pipe.publish(self._channel(test_id), self._event("updated", test_id, student_data))
+                    await pipe.execute()
+                    return student_data
+                except WatchError:
+                    # The room changed under us - re-read and try again
+                    continue
+    
+    async def remove_student(self, test_id: int, student_id: int, student_data: Optional[Dict[str, Any]] = None):
+        """Drop a student from the waiting room, announcing their final state"""
+        redis = await self._redis()
+        
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.hdel(self._key(test_id), str(student_id))
+            pipe.publish(
+                self._channel(test_id),
+                self._event("removed", test_id, student_data or {"student_id": student_id})
+            )
+            await pipe.execute()
+    
+    async def listen(self, test_id: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Yield waiting-room events for one test, or for every test"""
+        redis = await self._redis()
+        pubsub = redis.pubsub()
+        
+        if test_id is None:
+            await pubsub.psubscribe(f"{self.KEY_PREFIX}:*:events")
+        else:
+            await pubsub.subscribe(self._channel(test_id))
+        
+        try:
+            async for message in pubsub.listen():
+                if message["type"] in ("message", "pmessage"):
+                    yield json.loads(message["data"])
+        finally:
+            await pubsub.close()
+    
+    async def wait_for_change(
+        self,
+        test_id: int,
+        student_id: int,
+        since: Optional[str],
+        timeout: float
+    ) -> Dict[str, Any]:
+        """
+        Long-poll helper: return as soon as the student's status differs from
+        since, or the current state once timeout seconds have passed.
+        """
+        redis = await self._redis()
+        pubsub = redis.pubsub()
+        
+        # Subscribe before reading the current state so no change slips through
+        await pubsub.subscribe(self._channel(test_id))
+        
+        try:
+            student_data = await self.get_student(test_id, student_id)
+            current = {
+                "in_waiting_room": student_data is not None,
+                "status": student_data["status"] if student_data else None,
+                "details": student_data
+            }
+            if current["status"] != since:
+                return {**current, "changed": True}
+            
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + timeout
+            
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return {**current, "changed": False}
+                
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining)
+                if not message:
+                    continue
+                
+                event = json.loads(message["data"])
+                if str(event.get("student_id")) != str(student_id) or event.get("status") == since:
+                    continue
+                
+                return {
+                    "in_waiting_room": event["event"] != "removed",
+                    "status": event["status"],
+                    "details": event["student"],
+                    "changed": True
+                }
+        finally:
+            await pubsub.close()
+    
+    def _event(self, event: str, test_id: int, student_data: Dict[str, Any]) -> str:
+        return json.dumps({
+            "event": event,
+            "test_id": test_id,
+            "student_id": student_data.get("student_id"),
+            "status": student_data.get("status"),
+            "student": student_data
+        })
+
+waiting_room_service = WaitingRoomService()
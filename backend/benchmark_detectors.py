@@ -0,0 +1,106 @@
+"""
+Proctoring Detector Benchmark
+Replays a directory of frames through each face detector backend and reports
+throughput, latency and agreement with a reference backend
+
+Usage (from the backend directory):
+    python benchmark_detectors.py path/to/frames --backends haar,dnn --repeat 3
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from app.services.face_detectors import FACE_DETECTORS, create_face_detector
+from app.services.proctoring_service import ProctoringService
+
+FRAME_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+
+def load_frames(frames_dir: Path):
+    paths = sorted(p for p in frames_dir.iterdir() if p.suffix.lower() in FRAME_EXTENSIONS)
+    return [(p.name, p.read_bytes()) for p in paths]
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def run_backend(name, frames, repeat, analysis_width):
+    service = ProctoringService(detector=create_face_detector(name))
+    if analysis_width is not None:
+        service.ANALYSIS_WIDTH = analysis_width
+    
+    # Warm up so model loading and first-call allocations are not measured
+    service.analyze_frame_sync(frames[0][1])
+    
+    latencies = []
+    results = {}
+    started = time.perf_counter()
+    
+    for _ in range(repeat):
+        for frame_name, frame_bytes in frames:
+            t0 = time.perf_counter()
+            result = service.analyze_frame_sync(frame_bytes)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            results[frame_name] = result
+    
+    elapsed = time.perf_counter() - started
+    
+    return {
+        "fps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        "results": results
+    }
+
+def agreement(reference, candidate, field):
+    matches = sum(
+        1 for frame_name, result in reference.items()
+        if candidate[frame_name].get(field) == result.get(field)
+    )
+    return matches / len(reference) * 100
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark proctoring face detector backends")
+    parser.add_argument("frames_dir", type=Path, help="Directory of JPEG/PNG/WebP frames")
+    parser.add_argument(
+        "--backends",
+        default=",".join(FACE_DETECTORS),
+        help="Comma-separated backends; the first one is the accuracy reference"
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="Passes over the frame set")
+    parser.add_argument(
+        "--analysis-width",
+        type=int,
+        default=None,
+        help="Override PROCTORING_ANALYSIS_WIDTH (0 = native resolution)"
+    )
+    args = parser.parse_args()
+    
+    frames = load_frames(args.frames_dir)
+    if not frames:
+        print(f"No frames found in {args.frames_dir}")
+        sys.exit(1)
+    
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    print(f"Benchmarking {len(frames)} frames x {args.repeat} passes on: {', '.join(backends)}")
+    
+    reports = {}
+    for name in backends:
+        reports[name] = run_backend(name, frames, args.repeat, args.analysis_width)
+    
+    reference = reports[backends[0]]["results"]
+    
+    print()
+    print(f"{'backend':<10} {'fps':>8} {'p50 ms':>8} {'p99 ms':>8} {'faces %':>8} {'gaze %':>8}")
+    for name in backends:
+        report = reports[name]
+        print(
+            f"{name:<10} {report['fps']:>8.1f} {report['p50_ms']:>8.2f} {report['p99_ms']:>8.2f} "
+            f"{agreement(reference, report['results'], 'face_count'):>8.1f} "
+            f"{agreement(reference, report['results'], 'gaze_direction'):>8.1f}"
+        )
+    print(f"\nAgreement is measured against '{backends[0]}'")
+
+if __name__ == "__main__":
+    main()
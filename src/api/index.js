@@ -34,5 +34,56 @@ api.interceptors.response.use(
   }
 )
 
+// POST to an endpoint that answers with Server-Sent Events and call
+// onEvent(event, data) for each one as it arrives. Pass an AbortSignal to
+// cancel the request and stop reading the stream
+async function streamEvents(path, body, onEvent, { signal } = {}) {
+  const token = localStorage.getItem('token')
+  const response = await fetch(`${API_BASE}/v1${path}`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      ...(token ? { Authorization: `Bearer ${token}` } : {})
+    },
+    body: JSON.stringify(body),
+    signal
+  })
+
+  // Same as the axios interceptor, which fetch requests bypass
+  if (response.status === 401) {
+    localStorage.removeItem('token')
+    localStorage.removeItem('user')
+    window.location.href = '/login'
+  }
+
+  if (!response.ok) {
+    throw new Error(`Request failed with status ${response.status}`)
+  }
+
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ''
+
+  while (true) {
+    const { done, value } = await reader.read()
+    if (done) break
+    buffer += decoder.decode(value, { stream: true })
+
+    let boundary
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const message = buffer.slice(0, boundary)
+      buffer = buffer.slice(boundary + 2)
+
+      let event = 'message'
+      let data = ''
+      for (const line of message.split('\n')) {
+        if (line.startsWith('event: ')) event = line.slice(7)
+        else if (line.startsWith('data: ')) data += line.slice(6)
+      }
+      if (data) onEvent(event, JSON.parse(data))
+    }
+  }
+}
+
 export default api
-export { api }
+export { api, streamEvents }